@@ -0,0 +1,97 @@
+"""Micro-benchmark: single-pass html_extractor vs the old multi-regex extraction
+
+Run from the repository root:
+
+    python benchmarks/bench_html_extractor.py
+"""
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from html_extractor import extract_media  # noqa: E402
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+CASES = [
+    ('post_shared_data.html', 'C1a2B3c4D5e'),
+    ('post_json_island.html', 'C9z8Y7x6W5v'),
+]
+
+
+def legacy_extract(html_content):
+    """The extraction previously inlined in extract_photo_urls_from_html"""
+    photo_urls = []
+
+    shared_data_match = re.search(r'<script type="text/javascript">window\._sharedData = (.*?);</script>', html_content)
+    if shared_data_match:
+        try:
+            shared_data = json.loads(shared_data_match.group(1))
+            if 'entry_data' in shared_data and 'PostPage' in shared_data['entry_data']:
+                post_data = shared_data['entry_data']['PostPage'][0]['graphql']['shortcode_media']
+                if 'edge_sidecar_to_children' in post_data:
+                    for edge in post_data['edge_sidecar_to_children']['edges']:
+                        node = edge['node']
+                        if 'display_url' in node:
+                            photo_urls.append(node['display_url'])
+                elif 'display_url' in post_data:
+                    photo_urls.append(post_data['display_url'])
+        except Exception:
+            pass
+
+    if not photo_urls:
+        patterns = [
+            r'"display_url":"([^"]+)"',
+            r'"src":"([^"]+\.jpg[^"]*)"',
+            r'"src":"([^"]+\.png[^"]*)"',
+            r'"src":"([^"]+\.webp[^"]*)"'
+        ]
+        for pattern in patterns:
+            for match in re.findall(pattern, html_content, re.IGNORECASE):
+                if isinstance(match, str) and match.startswith('http'):
+                    clean_url = match.split('\\u0026')[0]
+                    clean_url = clean_url.replace('\\u0026', '&')
+                    clean_url = clean_url.replace('\\/', '/')
+                    if (clean_url not in photo_urls and
+                        any(ext in clean_url.lower() for ext in ['.jpg', '.png', '.webp']) and
+                        'instagram' not in clean_url.lower() and
+                        'logo' not in clean_url.lower() and
+                        'icon' not in clean_url.lower() and
+                        'cdninstagram' in clean_url.lower()):
+                        photo_urls.append(clean_url)
+
+    unique_urls = []
+    for url in dict.fromkeys(photo_urls):
+        if ('instagram' not in url.lower() or 'cdninstagram' in url.lower()) and \
+           'logo' not in url.lower() and \
+           'icon' not in url.lower() and \
+           'brand' not in url.lower():
+            unique_urls.append(url)
+    return unique_urls
+
+
+def timed(func, *args, rounds=50):
+    """Best-of-rounds wall time per call, in milliseconds"""
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    for filename, shortcode in CASES:
+        html = (FIXTURES / filename).read_text()
+        legacy_ms, legacy_result = timed(legacy_extract, html)
+        new_ms, new_result = timed(extract_media, html, shortcode)
+        print(f"{filename} ({len(html) // 1024}KB)")
+        print(f"  legacy:   {legacy_ms:7.3f} ms  {len(legacy_result)} media")
+        print(f"  compiled: {new_ms:7.3f} ms  {len(new_result)} media")
+        print(f"  speedup:  {legacy_ms / new_ms:7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
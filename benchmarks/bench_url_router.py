@@ -0,0 +1,98 @@
+"""Micro-benchmark: precompiled url_router vs the old per-message regex chain
+
+Run from the repository root:
+
+    python benchmarks/bench_url_router.py
+"""
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from url_router import parse_url  # noqa: E402
+
+CORPUS = Path(__file__).resolve().parent / 'fixtures' / 'messages.txt'
+
+
+def legacy_is_instagram_url(text):
+    instagram_patterns = [
+        r'https?://(?:www\.)?instagram\.com/p/[a-zA-Z0-9_-]+/?',
+        r'https?://(?:www\.)?instagram\.com/reel/[a-zA-Z0-9_-]+/?',
+        r'https?://(?:www\.)?instagram\.com/tv/[a-zA-Z0-9_-]+/?',
+        r'https?://(?:www\.)?instagram\.com/stories/[^/]+/\d+/?',
+        r'https?://(?:www\.)?instagram\.com/[^/]+/?'
+    ]
+    for pattern in instagram_patterns:
+        if re.search(pattern, text):
+            return True
+    return False
+
+
+def legacy_extract_shortcode(url):
+    patterns = [
+        r'instagram\.com/p/([a-zA-Z0-9_-]+)',
+        r'instagram\.com/reel/([a-zA-Z0-9_-]+)',
+        r'instagram\.com/tv/([a-zA-Z0-9_-]+)',
+        r'instagram\.com/stories/[^/]+/(\d+)',
+        r'instagram\.com/([^/]+)'
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, url)
+        if match:
+            return match.group(1)
+    return None
+
+
+def legacy_detect_content_type(url):
+    if '/stories/' in url:
+        return 'story'
+    elif '/reel/' in url or '/tv/' in url:
+        return 'video'
+    elif '/p/' in url:
+        return 'post'
+    else:
+        return 'unknown'
+
+
+def legacy_route(text):
+    """What process_update and download_instagram_content used to do per message"""
+    if not legacy_is_instagram_url(text):
+        return None
+    content_type = legacy_detect_content_type(text)
+    shortcode = legacy_extract_shortcode(text)
+    # download_instagram_content parsed the same text again
+    legacy_extract_shortcode(text)
+    legacy_detect_content_type(text)
+    return content_type, shortcode
+
+
+def route(text):
+    parsed = parse_url(text)
+    return (parsed.content_type, parsed.key) if parsed else None
+
+
+def timed(func, messages, rounds=200):
+    """Best-of-rounds wall time for one pass over the corpus, in microseconds per message"""
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for text in messages:
+            func(text)
+        best = min(best, time.perf_counter() - start)
+    return best / len(messages) * 1e6
+
+
+def main():
+    messages = [line for line in CORPUS.read_text().splitlines() if line.strip()]
+    legacy_us = timed(legacy_route, messages)
+    new_us = timed(route, messages)
+    print(f"{len(messages)} messages")
+    print(f"  legacy:   {legacy_us:7.2f} us/message")
+    print(f"  compiled: {new_us:7.2f} us/message")
+    print(f"  speedup:  {legacy_us / new_us:7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    def __init__(self, future):
+        self.future = future
+        self.users = 0
+
+
+class RequestCoalescer:
+    """Single-flight: concurrent requests for the same key share one in-flight call
+
+    The shared result stays registered until the last user releases it, so a
+    request arriving while earlier ones are still delivering reuses the same
+    result instead of starting a second download into the same files.
+    """
+
+    def __init__(self, on_release=None):
+        self.on_release = on_release
+        self.flights = {}
+        self.coalesced = 0
+
+    @asynccontextmanager
+    async def share(self, key, factory):
+        """Run factory() once per key and yield its result to every concurrent caller"""
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(factory()))
+            self.flights[key] = flight
+        else:
+            self.coalesced += 1
+            logger.info(f"Joining in-flight request for {key}")
+
+        flight.users += 1
+        try:
+            # Shielded so one caller going away doesn't cancel the work for the others
+            yield await asyncio.shield(flight.future)
+        finally:
+            self._release(key, flight)
+
+    def _release(self, key, flight):
+        flight.users -= 1
+        if flight.users > 0:
+            return
+
+        del self.flights[key]
+        if not flight.future.done():
+            # Every caller gave up; nobody is left to use the result
+            flight.future.cancel()
+        elif self.on_release and not flight.future.cancelled() and flight.future.exception() is None:
+            self.on_release(flight.future.result())
+
+    @property
+    def in_flight(self):
+        return len(self.flights)
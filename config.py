@@ -7,11 +7,42 @@ class Config:
     # Telegram Bot Configuration
     TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN', '8112287877:AAFmCdwBRWYDYkeUw-uFc4a4LA4-j-yI9Ak')
     
+    # Webhook Configuration (polling is used when WEBHOOK_URL is unset)
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+    
+    # Port for a Prometheus /metrics listener in robust_instagram_bot.py (web_bot.py serves it through Flask)
+    METRICS_PORT = int(os.getenv('METRICS_PORT')) if os.getenv('METRICS_PORT') else None
+    
+    # Crash-safe journal of accepted updates and their progress, resumed on restart
+    JOURNAL_DB = os.getenv('JOURNAL_DB', 'journal.db')
+    JOURNAL_COMMIT_INTERVAL = 5.0  # seconds between offset writes
+    JOURNAL_MAX_ATTEMPTS = 3  # Restarts an interrupted update is resumed for before it is dropped
+    
+    # Scale-out (web_bot.py): with JOB_QUEUE_DB set, updates go through a shared
+    # durable queue; BOT_ROLE picks what this process does: all, ingress or worker
+    JOB_QUEUE_DB = os.getenv('JOB_QUEUE_DB')
+    BOT_ROLE = os.getenv('BOT_ROLE', 'all')
+    JOB_VISIBILITY_TIMEOUT = 300  # seconds a leased job stays hidden; running workers renew it
+    JOB_MAX_ATTEMPTS = 3  # Leases (crashes included) before a job is parked as dead
+    JOB_POLL_INTERVAL = 1.0  # seconds an idle worker waits before checking the queue again
+    JOB_RETENTION = 24 * 3600  # seconds finished jobs are kept for deduplication
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', '1'))  # Worker processes sharing the bot token's global send rate
+    POLLER_LOCK_TTL = 90  # Must outlast one long poll
+    
     # AWS S3 Configuration
     AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
     AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
     S3_BUCKET_NAME = os.getenv('S3_BUCKET_NAME')
+    S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')  # For S3-compatible stores such as MinIO
+    S3_PREFIX = os.getenv('S3_PREFIX', 'media/')
+    S3_EXPIRY_DAYS = int(os.getenv('S3_EXPIRY_DAYS', '7'))  # Lifecycle expiry for stored media
+    S3_MANAGE_LIFECYCLE = os.getenv('S3_MANAGE_LIFECYCLE', 'true').lower() == 'true'
+    S3_URL_TTL = 3600  # seconds a presigned URL stays valid
+    S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+    S3_MULTIPART_CHUNK = 8 * 1024 * 1024
+    S3_MAX_CONCURRENCY = 4  # Parts uploaded in parallel per file
     
     # Instagram Configuration
     INSTAGRAM_USERNAME = os.getenv('INSTAGRAM_USERNAME')
@@ -22,12 +53,68 @@ class Config:
     PROXY_LIST = os.getenv('PROXY_LIST', '').split(',') if os.getenv('PROXY_LIST') else []
     PROXY_USERNAME = os.getenv('PROXY_USERNAME')
     PROXY_PASSWORD = os.getenv('PROXY_PASSWORD')
+    PROXY_HOSTS = ('instagram.com', 'cdninstagram.com', 'fbcdn.net')  # Only these are fetched through proxies
+    PROXY_RETRIES = 2  # Other proxies tried after a 429 or login wall
+    PROXY_EJECT_SECONDS = 300  # First ejection; doubles on each repeat
+    PROXY_SCORE_DECAY = 0.2  # Weight of the newest sample in latency/error averages
+    PROXY_PROBE_INTERVAL = 60
+    PROXY_PROBE_URL = os.getenv('PROXY_PROBE_URL', 'https://www.instagram.com/robots.txt')
     
     # Bot Settings
     MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB Telegram limit
     DOWNLOAD_TIMEOUT = 300  # 5 minutes
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024  # Bytes written per chunk when streaming media to disk
     MAX_CONCURRENT_DOWNLOADS = 3
+    MAX_PARALLEL_DOWNLOADS = int(os.getenv('MAX_PARALLEL_DOWNLOADS', '10'))  # Media files across all posts
+    CAROUSEL_FANOUT = 3  # Media files fetched at once for a single post (keep below MAX_CAROUSEL_ITEMS)
+    MAX_CAROUSEL_ITEMS = 5
+    MAX_BATCH_URLS = 10  # Links handled from a single message
+    MEDIA_GROUP_LIMIT = 10  # Telegram's maximum items per album
+    DIRECT_URL_DELIVERY = os.getenv('DIRECT_URL_DELIVERY', 'true').lower() == 'true'  # Let Telegram fetch CDN URLs itself
+    STREAM_RELAY = os.getenv('STREAM_RELAY', 'true').lower() == 'true'  # Pipe CDN downloads into uploads without temp files
+    RELAY_BUFFER_CHUNKS = 16  # Chunks buffered per relayed file before the download is paused
+    RELAY_TIMEOUT = 300  # seconds for a whole relayed upload, downloads included
+    YTDLP_WORKERS = int(os.getenv('YTDLP_WORKERS', '2'))  # yt-dlp runs allowed at once
+    YTDLP_TIMEOUT = 120  # seconds before a yt-dlp run is killed
+    MEDIA_CACHE_SIZE = int(os.getenv('MEDIA_CACHE_SIZE', '1000'))  # Posts whose file_ids are kept
+    MEDIA_CACHE_TTL = 7 * 24 * 3600  # seconds before a cached file_id is re-uploaded
+    METADATA_CACHE_SIZE = int(os.getenv('METADATA_CACHE_SIZE', '5000'))  # Posts whose CDN URLs are kept
+    METADATA_CACHE_TTL = 6 * 3600  # Upper bound; signed CDN URLs usually expire sooner
+    METADATA_CACHE_DB = os.getenv('METADATA_CACHE_DB')  # SQLite file to keep the cache across restarts
+    METADATA_NEGATIVE_TTL = 120  # seconds a post that failed to resolve isn't fetched again
+    
+    # HTTP client pool (Instagram page, API and CDN fetches)
+    HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '20'))
+    HTTP_MAX_KEEPALIVE = int(os.getenv('HTTP_MAX_KEEPALIVE', '10'))
+    HTTP_KEEPALIVE_EXPIRY = 30  # seconds an idle connection stays pooled
+    HTTP_PER_HOST_LIMIT = int(os.getenv('HTTP_PER_HOST_LIMIT', '6'))
+    HTTP_CONNECT_TIMEOUT = 10
+    HTTP_READ_TIMEOUT = 30
+    
+    # Telegram outbound rate limits
+    TELEGRAM_GLOBAL_RATE = 30  # messages per second across all chats
+    TELEGRAM_CHAT_RATE = 1.0  # messages per second to one private chat
+    TELEGRAM_CHAT_BURST = 3
+    TELEGRAM_GROUP_RATE = 20  # messages per minute to one group
+    TELEGRAM_GROUP_BURST = 5
+    TELEGRAM_MAX_RETRIES = 3  # RetryAfter retries before a send fails
+    TELEGRAM_BUCKET_LIMIT = 10000  # Per-chat buckets kept before idle ones are pruned
+    PROGRESS_EDIT_INTERVAL = 2.0  # Minimum seconds between edits of a progress message
     
     # File paths
     TEMP_DIR = 'temp'
-    FFMPEG_PATH = os.getenv('FFMPEG_PATH', 'ffmpeg')  # Path to FFmpeg executable 
\ No newline at end of file
+    SCRATCH_QUOTA = int(os.getenv('SCRATCH_QUOTA_MB', '2048')) * 1024 * 1024  # Disk reserved for in-flight downloads
+    SCRATCH_JOB_RESERVE = MAX_FILE_SIZE  # Space reserved per download job before it may start
+    SCRATCH_MAX_AGE = 3600  # seconds before a job directory is treated as leaked
+    SCRATCH_SWEEP_INTERVAL = 300  # seconds between eviction sweeps
+    SCRATCH_TMPFS_DIR = os.getenv('SCRATCH_TMPFS_DIR')  # e.g. /dev/shm/instagram-bot for photo jobs
+    SCRATCH_TMPFS_QUOTA = int(os.getenv('SCRATCH_TMPFS_QUOTA_MB', '256')) * 1024 * 1024
+    FFMPEG_PATH = os.getenv('FFMPEG_PATH', 'ffmpeg')  # Path to FFmpeg executable 
+    TRANSCODE_ENABLED = os.getenv('TRANSCODE_ENABLED', 'true').lower() == 'true'  # Compress videos over MAX_FILE_SIZE
+    TRANSCODE_CACHE_DIR = 'transcoded'  # Kept outside TEMP_DIR so the scratch sweep leaves it alone
+    TRANSCODE_CACHE_SIZE = 20  # Compressed videos kept for re-sends
+    TRANSCODE_AUDIO_BITRATE = 96 * 1000
+    TRANSCODE_MIN_VIDEO_BITRATE = 150 * 1000  # Below this a video is too long to be worth compressing
+    TRANSCODE_MAX_HEIGHT = 720
+    FFMPEG_WORKERS = int(os.getenv('FFMPEG_WORKERS', '1'))  # ffmpeg encodes allowed at once
+    FFMPEG_TIMEOUT = 600  # seconds before an encode is killed 
\ No newline at end of file
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# How many recent update ids are remembered for out-of-order (webhook) deduplication
+RECENT_IDS = 10000
+
+
+class UpdateDispatcher:
+    """Process updates concurrently while keeping each chat's updates in order"""
+
+    def __init__(self, handler, max_concurrent, on_commit=None):
+        self.handler = handler
+        self.on_commit = on_commit
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+
+        # Per-chat locks serialize updates from the same chat; the refcount
+        # lets us drop a lock once nobody is holding or waiting on it
+        self.chat_locks = {}
+        self.chat_refs = {}
+
+        self.tasks = set()
+        self.in_flight = set()
+        self.last_seen_id = 0
+        self.committed_id = 0
+        self.recent_ids = set()
+        self.recent_order = deque()
+
+    @property
+    def next_offset(self):
+        """Offset for the next get_updates call (skips updates already dispatched)"""
+        return self.last_seen_id + 1
+
+    @property
+    def active(self):
+        """Number of updates currently queued or running"""
+        return len(self.in_flight)
+
+    def resume(self, committed_id, pending=(), last_seen_id=0):
+        """Continue from a persisted position: updates up to committed_id are done,
+        `pending` ones are run again and nothing up to last_seen_id is fetched twice
+        """
+        pending = list(pending)
+        # An update that failed may sit below the committed id; it still gets its rerun
+        start = min([committed_id] + [update.update_id - 1 for update in pending])
+        self.committed_id = self.last_seen_id = start
+        for update in pending:
+            self.submit(update)
+        self.last_seen_id = max(self.last_seen_id, last_seen_id)
+
+    def seen(self, update, by_id=False):
+        """Whether an update was already dispatched
+
+        Polling hands out updates in id order, so anything at or below the
+        highest id seen is a repeat. Webhook deliveries can arrive out of
+        order; with by_id only the ids actually dispatched recently count.
+        """
+        if by_id:
+            return update.update_id in self.recent_ids
+        return update.update_id <= self.last_seen_id
+
+    def submit(self, update, by_id=False):
+        """Schedule an update for processing, ignoring ones already seen"""
+        if self.seen(update, by_id):
+            return None
+
+        self.last_seen_id = max(self.last_seen_id, update.update_id)
+        self.recent_ids.add(update.update_id)
+        self.recent_order.append(update.update_id)
+        if len(self.recent_order) > RECENT_IDS:
+            self.recent_ids.discard(self.recent_order.popleft())
+        self.in_flight.add(update.update_id)
+
+        task = asyncio.create_task(self._run(update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def _chat_key(self, update):
+        chat = update.effective_chat
+        # Updates without a chat have no ordering constraint
+        return chat.id if chat else ('update', update.update_id)
+
+    async def _run(self, update):
+        chat_key = self._chat_key(update)
+        lock = self.chat_locks.setdefault(chat_key, asyncio.Lock())
+        self.chat_refs[chat_key] = self.chat_refs.get(chat_key, 0) + 1
+
+        try:
+            # Take the chat lock before a worker slot so a busy chat
+            # doesn't hold slots while its later updates are waiting
+            async with lock:
+                async with self.semaphore:
+                    await self.handler(update)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing update {update.update_id}: {e}")
+        finally:
+            self.chat_refs[chat_key] -= 1
+            if self.chat_refs[chat_key] == 0:
+                del self.chat_refs[chat_key]
+                del self.chat_locks[chat_key]
+
+            self.in_flight.discard(update.update_id)
+            self._commit()
+
+    def _commit(self):
+        """Advance the committed id to the highest update with nothing older still pending"""
+        if self.in_flight:
+            committed = min(self.in_flight) - 1
+        else:
+            committed = self.last_seen_id
+
+        if committed > self.committed_id:
+            self.committed_id = committed
+            if self.on_commit:
+                self.on_commit(committed)
+
+    async def drain(self):
+        """Wait for every dispatched update to finish"""
+        if self.tasks:
+            await asyncio.gather(*list(self.tasks), return_exceptions=True)
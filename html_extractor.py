@@ -0,0 +1,158 @@
+import json
+import logging
+import re
+
+from media_descriptor import MediaDescriptor
+
+logger = logging.getLogger(__name__)
+
+# Only script bodies that mention one of these keys are worth decoding
+_MEDIA_KEY_RE = re.compile(r'"(?:display_url|image_versions2|video_url|video_versions)"')
+
+# Fallback when no JSON island decodes: raw "display_url"/"src" string literals
+_URL_LITERAL_RE = re.compile(r'"(?:display_url|src)":("https?:[^"]+")', re.I)
+_IMAGE_URL_RE = re.compile(r'^https?://[^/]*(?:cdninstagram|fbcdn)[^?]*\.(?:jpg|jpeg|png|webp)', re.I)
+_ASSET_RE = re.compile(r'logo|icon|brand', re.I)
+
+
+def _media_scripts(html):
+    """Yield script bodies containing media keys in one forward scan of the page
+
+    Each step jumps straight to the next media key and cuts out the script
+    around it, so the inline JS bundles that make up most of the page are
+    scanned once by the key pattern and never sliced or decoded.
+    """
+    pos = 0
+    while True:
+        match = _MEDIA_KEY_RE.search(html, pos)
+        if not match:
+            return
+
+        close = html.find('</script>', match.end())
+        if close == -1:
+            return
+        start = html.rfind('<script', pos, match.start())
+        if start != -1:
+            body_start = html.find('>', start, match.start())
+            if body_start != -1:
+                yield html[body_start + 1:close]
+
+        pos = close + len('</script>')
+
+
+def _json_island(body):
+    """Decode the JSON object embedded in a script body, or None"""
+    body = body.strip()
+    if body[:1] not in ('{', '['):
+        # window._sharedData = {...}; / window.__additionalDataLoaded('...', {...});
+        start = body.find('{')
+        end = body.rfind('}')
+        if start == -1 or end <= start:
+            return None
+        body = body[start:end + 1]
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+def _graphql_media(node):
+    """Descriptors for a graphql shortcode_media node (legacy _sharedData layout)"""
+    if node.get('is_video') and node.get('video_url'):
+        dimensions = node.get('dimensions') or {}
+        return [MediaDescriptor(node['video_url'], 'video', dimensions.get('width'), dimensions.get('height'))]
+    if node.get('display_url'):
+        dimensions = node.get('dimensions') or {}
+        return [MediaDescriptor(node['display_url'], 'photo', dimensions.get('width'), dimensions.get('height'))]
+    return []
+
+
+def _api_media(item):
+    """Descriptors for an API-style media item (image_versions2 / video_versions)"""
+    versions = item.get('video_versions')
+    media_type = 'video'
+    if not versions:
+        versions = (item.get('image_versions2') or {}).get('candidates')
+        media_type = 'photo'
+    if not versions:
+        return []
+    best = versions[0]
+    return [MediaDescriptor(best['url'], media_type, best.get('width'), best.get('height'))]
+
+
+def _walk(node, shortcode, found, roots):
+    """Collect media from a decoded JSON tree, expanding carousels in order
+
+    Nodes whose shortcode/code matches the requested post are also recorded in
+    roots, so media from related posts on the page can be ignored.
+    """
+    if isinstance(node, list):
+        for child in node:
+            _walk(child, shortcode, found, roots)
+        return
+    if not isinstance(node, dict):
+        return
+
+    media = None
+    if 'edge_sidecar_to_children' in node:
+        media = []
+        for edge in node['edge_sidecar_to_children'].get('edges', []):
+            media.extend(_graphql_media(edge.get('node') or {}))
+    elif node.get('carousel_media'):
+        media = []
+        for item in node['carousel_media']:
+            media.extend(_api_media(item))
+    elif 'display_url' in node:
+        media = _graphql_media(node)
+    elif 'image_versions2' in node or 'video_versions' in node:
+        media = _api_media(node)
+
+    if media is not None:
+        found.extend(media)
+        if shortcode and shortcode in (node.get('shortcode'), node.get('code')):
+            roots.extend(media)
+        # A media node's children are its own renditions; don't descend further
+        return
+
+    for value in node.values():
+        if isinstance(value, (dict, list)):
+            _walk(value, shortcode, found, roots)
+
+
+def _dedupe(media):
+    seen = set()
+    unique = []
+    for item in media:
+        if item.url not in seen:
+            seen.add(item.url)
+            unique.append(item)
+    return unique
+
+
+def _url_literals(html):
+    """Fallback scan for CDN image URLs written as JSON string literals"""
+    media = []
+    for literal in _URL_LITERAL_RE.findall(html):
+        try:
+            url = json.loads(literal)  # Undoes JSON string escapes such as \/
+        except ValueError:
+            continue
+        if _IMAGE_URL_RE.match(url) and not _ASSET_RE.search(url):
+            media.append(MediaDescriptor(url))
+    return media
+
+
+def extract_media(html, shortcode=None):
+    """Extract deduplicated media descriptors from an Instagram page in carousel order"""
+    found = []
+    roots = []
+    for body in _media_scripts(html):
+        data = _json_island(body)
+        if data is not None:
+            _walk(data, shortcode, found, roots)
+
+    # Prefer the requested post's media over anything else embedded in the page
+    media = roots or found
+    if not media:
+        media = _url_literals(html)
+    return _dedupe(media)
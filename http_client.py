@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager, nullcontext
+from urllib.parse import urlparse
+
+import httpx
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def build_client(config, headers, proxies=None):
+    """An httpx client with the bot's pool limits and timeouts"""
+    return httpx.AsyncClient(
+        headers=headers,
+        limits=httpx.Limits(
+            max_connections=config.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=config.HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(
+            config.HTTP_READ_TIMEOUT,
+            connect=config.HTTP_CONNECT_TIMEOUT
+        ),
+        proxies=proxies,
+        follow_redirects=True
+    )
+
+
+class AsyncHTTPClient:
+    """Shared async HTTP client with pooled keep-alive connections and per-host limits
+
+    With a proxy pool, requests to the hosts it covers go out through a
+    scored proxy, each with its own connection pool; rate-limited or
+    login-walled responses are retried through another proxy.
+    """
+
+    def __init__(self, headers=None, config=None, proxy_pool=None):
+        self.config = config or Config()
+        self.headers = headers or {}
+        self.proxy_pool = proxy_pool
+        self._client = None
+        self._host_limits = {}
+
+    @property
+    def client(self):
+        """Lazily create the pooled client inside the running event loop"""
+        if self._client is None:
+            self._client = build_client(self.config, self.headers)
+        return self._client
+
+    def _host_limit(self, url):
+        """Semaphore capping concurrent requests to a single host"""
+        host = urlparse(url).hostname or ''
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.config.HTTP_PER_HOST_LIMIT)
+        return self._host_limits[host]
+
+    def _routes(self, url):
+        """(proxy, client) pairs to try for url, in order; proxy is None for a direct request"""
+        if self.proxy_pool is None or not self.proxy_pool.covers(url):
+            return [(None, self.client)]
+        proxies = []
+        for _ in range(1 + self.config.PROXY_RETRIES):
+            proxy = self.proxy_pool.choose(exclude=proxies)
+            if proxy is None:
+                break
+            proxies.append(proxy)
+        if not proxies:
+            # Every proxy is ejected: going direct beats failing outright
+            return [(None, self.client)]
+        return [(proxy, self.proxy_pool.client(proxy)) for proxy in proxies]
+
+    async def _send(self, method, url, stream, **kwargs):
+        """Send through the first route whose response isn't blocked or failed"""
+        routes = self._routes(url)
+        for attempt, (proxy, client) in enumerate(routes, 1):
+            last = attempt == len(routes)
+            started = time.monotonic()
+            try:
+                response = await client.send(client.build_request(method, url, **kwargs), stream=stream)
+            except httpx.TransportError:
+                if proxy is not None:
+                    self.proxy_pool.record(proxy, False)
+                if last:
+                    raise
+                continue
+
+            if proxy is None or self.proxy_pool.observe(proxy, response, time.monotonic() - started) or last:
+                return response
+            if stream:
+                await response.aclose()
+
+    async def get(self, url, **kwargs):
+        """GET a URL and return the fully read response"""
+        async with self._host_limit(url):
+            return await self._send('GET', url, False, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method, url, host_limit=True, **kwargs):
+        """Open a streaming response; the host slot is held until the body is consumed
+
+        host_limit=False skips the per-host cap, for callers that hold several
+        streams to one host at once and would otherwise deadlock on its slots.
+        """
+        async with self._host_limit(url) if host_limit else nullcontext():
+            response = await self._send(method, url, True, **kwargs)
+            try:
+                yield response
+            finally:
+                await response.aclose()
+
+    async def aclose(self):
+        """Close pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self.proxy_pool is not None:
+            await self.proxy_pool.aclose()
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+Job = namedtuple('Job', ['id', 'update_id', 'chat_id', 'payload', 'attempts'])
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    update_id INTEGER NOT NULL UNIQUE,
+    chat_id INTEGER,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (state, id);
+CREATE INDEX IF NOT EXISTS jobs_chat ON jobs (chat_id, id);
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+# The oldest unfinished job of each chat, if it's free to take: per-chat
+# order holds across workers because a chat's next job only becomes
+# visible once the one before it is acked
+_LEASABLE = '''
+SELECT id, update_id, chat_id, payload, attempts FROM jobs j
+WHERE (j.state = 'queued' OR (j.state = 'leased' AND j.lease_expires < ?))
+  AND NOT EXISTS (
+      SELECT 1 FROM jobs o
+      WHERE o.chat_id IS j.chat_id AND o.id < j.id AND o.state IN ('queued', 'leased')
+  )
+ORDER BY j.id
+LIMIT 1
+'''
+
+
+class JobQueue:
+    """Durable job queue and shared state for bot processes, in one SQLite file
+
+    Ingress processes enqueue updates (deduplicated by update_id); worker
+    processes lease them. A lease is invisible to other workers until it
+    expires, so a crashed worker's job is picked up again after the
+    visibility timeout; running workers renew their leases. Jobs that keep
+    failing that way are parked as dead after max_attempts. The update
+    offset and the poller lock live in the same file, so every process
+    sharing it agrees on them.
+    """
+
+    def __init__(self, path, visibility_timeout, max_attempts):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._db().executescript(_SCHEMA)
+
+    def _db(self):
+        # One connection per thread: Flask's request threads enqueue too
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def enqueue(self, update_id, chat_id, payload):
+        """Add a job; returns False if this update was already queued"""
+        cursor = self._db().execute(
+            'INSERT OR IGNORE INTO jobs (update_id, chat_id, payload) VALUES (?, ?, ?)',
+            (update_id, chat_id, json.dumps(payload))
+        )
+        return cursor.rowcount == 1
+
+    def lease(self, owner):
+        """Take the next available job for visibility_timeout seconds, or None"""
+        with self._transaction() as db:
+            while True:
+                now = time.time()
+                row = db.execute(_LEASABLE, (now,)).fetchone()
+                if row is None:
+                    return None
+                job = Job(row[0], row[1], row[2], json.loads(row[3]), row[4] + 1)
+                if row[4] >= self.max_attempts:
+                    logger.error(f"Update {job.update_id} failed {row[4]} times, giving up on it")
+                    db.execute("UPDATE jobs SET state = 'dead', finished_at = ? WHERE id = ?", (now, job.id))
+                    continue
+                db.execute(
+                    "UPDATE jobs SET state = 'leased', owner = ?, lease_expires = ?, attempts = ? WHERE id = ?",
+                    (owner, now + self.visibility_timeout, job.attempts, job.id)
+                )
+                return job
+
+    def extend(self, job, owner):
+        """Renew a lease; returns False if it expired and another worker took the job"""
+        cursor = self._db().execute(
+            "UPDATE jobs SET lease_expires = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+            (time.time() + self.visibility_timeout, job.id, owner)
+        )
+        return cursor.rowcount == 1
+
+    def ack(self, job, owner):
+        """Mark a job finished; returns False if the lease was lost and another worker owns it now"""
+        cursor = self._db().execute(
+            "UPDATE jobs SET state = 'done', finished_at = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+            (time.time(), job.id, owner)
+        )
+        return cursor.rowcount == 1
+
+    def purge(self, older_than):
+        """Forget finished and dead jobs older than `older_than` seconds"""
+        self._db().execute(
+            "DELETE FROM jobs WHERE state IN ('done', 'dead') AND finished_at < ?", (time.time() - older_than,)
+        )
+
+    def get_offset(self):
+        """The next update id to fetch from Telegram"""
+        row = self._db().execute("SELECT value FROM kv WHERE key = 'offset'").fetchone()
+        return int(row[0]) if row else 0
+
+    def advance_offset(self, offset):
+        """Move the shared offset forward (never backwards)"""
+        self._db().execute(
+            "INSERT INTO kv (key, value) VALUES ('offset', ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), CAST(excluded.value AS INTEGER))",
+            (offset,)
+        )
+
+    def try_lock(self, name, owner, ttl):
+        """Hold a named lock for ttl seconds; re-acquiring extends it. Returns whether we hold it"""
+        with self._transaction() as db:
+            row = db.execute('SELECT value FROM kv WHERE key = ?', (f"lock:{name}",)).fetchone()
+            now = time.time()
+            if row:
+                holder = json.loads(row[0])
+                if holder['owner'] != owner and holder['expires'] > now:
+                    return False
+            db.execute(
+                'INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)',
+                (f"lock:{name}", json.dumps({'owner': owner, 'expires': now + ttl}))
+            )
+            return True
+
+    def stats(self):
+        """Job counts by state"""
+        counts = dict(self._db().execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+        return {state: counts.get(state, 0) for state in ('queued', 'leased', 'done', 'dead')}
+
+
+class JobWorker:
+    """Consumes a JobQueue with up to `concurrency` jobs in flight, renewing their leases"""
+
+    def __init__(self, queue, handler, concurrency, poll_interval, retention):
+        self.queue = queue
+        self.handler = handler
+        self.slots = asyncio.Semaphore(concurrency)
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.last_purge = 0.0
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.tasks = set()
+
+    @property
+    def active(self):
+        return len(self.tasks)
+
+    async def run(self):
+        """Lease and process jobs forever"""
+        logger.info(f"Worker {self.owner} consuming jobs from {self.queue.path}")
+        while True:
+            await self.slots.acquire()
+            try:
+                job = await asyncio.to_thread(self.queue.lease, self.owner)
+                if job is None and time.monotonic() - self.last_purge > self.retention:
+                    self.last_purge = time.monotonic()
+                    await asyncio.to_thread(self.queue.purge, self.retention)
+            except Exception as e:
+                logger.error(f"Job queue error: {e}")
+                job = None
+            if job is None:
+                self.slots.release()
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            task = asyncio.create_task(self._process(job))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _process(self, job):
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            try:
+                await self.handler(job)
+            except Exception as e:
+                logger.error(f"Error processing update {job.update_id}: {e}")
+            # Cancelled (shutdown) jobs are left leased: the lease runs out and another worker retries them
+            heartbeat.cancel()
+            if not await asyncio.to_thread(self.queue.ack, job, self.owner):
+                logger.warning(f"Update {job.update_id} was handed to another worker before it finished here")
+        finally:
+            heartbeat.cancel()
+            self.slots.release()
+
+    async def _heartbeat(self, job):
+        while True:
+            await asyncio.sleep(self.queue.visibility_timeout / 3)
+            if not await asyncio.to_thread(self.queue.extend, job, self.owner):
+                logger.warning(f"Lost the lease on update {job.update_id}; another worker may repeat it")
+                return
+
+    async def drain(self):
+        """Wait for jobs already leased to finish"""
+        if self.tasks:
+            await asyncio.gather(*list(self.tasks), return_exceptions=True)
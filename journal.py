@@ -0,0 +1,215 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS updates (
+    update_id INTEGER PRIMARY KEY,
+    payload TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS steps (
+    update_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    data TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (update_id, key)
+);
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+
+class JournalJob:
+    """Progress of one link of one update: None, then resolved, downloaded and sent"""
+
+    def __init__(self, journal, update_id, key, state=None, data=None):
+        self.journal = journal
+        self.update_id = update_id
+        self.key = key
+        self.state = state
+        self.data = data
+
+    async def mark(self, state, data=None):
+        """Record that the job reached state; data is whatever is needed to resume from there"""
+        self.state = state
+        self.data = data
+        if self.update_id is not None:
+            await asyncio.to_thread(self.journal.record, self.update_id, self.key, state, data)
+
+
+class UpdateJournal:
+    """Write-ahead journal of accepted updates and their progress, in SQLite
+
+    Updates are written here before the next get_updates call confirms them
+    to Telegram, and marked done once handled; whatever is left unfinished
+    after a crash is run again on the next start. Each link records how far
+    it got (resolved media, downloaded files, sent), so a resumed update
+    skips the steps that already succeeded. The committed offset is only
+    written every commit_interval seconds: the database runs in WAL mode
+    with synchronous=NORMAL, and batching keeps fsyncs off the hot path.
+    Calls made from the event loop run in a worker thread, so a journal
+    locked by another process never stalls the bot.
+    """
+
+    def __init__(self, path, commit_interval, max_attempts, retention):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.committed = None
+        self.last_flush = time.monotonic()
+        self.flusher = None
+        self._local = threading.local()
+        self._db().executescript(_SCHEMA)
+
+    def _db(self):
+        # One connection per thread: writes run in asyncio.to_thread workers
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    @property
+    def offset(self):
+        """Highest update id with every earlier update handled, as of the last flush"""
+        row = self._db().execute("SELECT value FROM kv WHERE key = 'offset'").fetchone()
+        return int(row[0]) if row else 0
+
+    @property
+    def last_accepted(self):
+        row = self._db().execute('SELECT MAX(update_id) FROM updates').fetchone()
+        return max(row[0] or 0, self.offset)
+
+    async def accept(self, updates):
+        """Record a batch of updates before they are dispatched, in one transaction"""
+        rows = [(update.update_id, json.dumps(update.to_dict())) for update in updates]
+        if rows:
+            await asyncio.to_thread(self._accept, rows)
+
+    def _accept(self, rows):
+        with self._transaction() as db:
+            db.executemany('INSERT OR IGNORE INTO updates (update_id, payload) VALUES (?, ?)', rows)
+
+    async def finish(self, update_id):
+        """Mark an update handled and forget its per-link progress"""
+        await asyncio.to_thread(self._finish, update_id)
+
+    def _finish(self, update_id):
+        with self._transaction() as db:
+            db.execute('UPDATE updates SET done = 1 WHERE update_id = ?', (update_id,))
+            db.execute('DELETE FROM steps WHERE update_id = ?', (update_id,))
+
+    def pending(self):
+        """Payloads of accepted updates that never finished, oldest first, counting this attempt
+
+        Updates that already failed max_attempts runs are given up on.
+        """
+        pending = []
+        rows = self._db().execute(
+            'SELECT update_id, payload, attempts FROM updates WHERE done = 0 ORDER BY update_id'
+        ).fetchall()
+        for update_id, payload, attempts in rows:
+            if attempts >= self.max_attempts:
+                logger.error(f"Update {update_id} was interrupted {attempts} times, giving up on it")
+                self._finish(update_id)
+                continue
+            self._db().execute('UPDATE updates SET attempts = attempts + 1 WHERE update_id = ?', (update_id,))
+            pending.append(json.loads(payload))
+        return pending
+
+    async def job(self, update_id, key):
+        """Progress of one link of an update; without an update id nothing is recorded"""
+        if update_id is None:
+            return JournalJob(self, None, key)
+        row = await asyncio.to_thread(
+            lambda: self._db().execute(
+                'SELECT state, data FROM steps WHERE update_id = ? AND key = ?', (update_id, key)
+            ).fetchone()
+        )
+        if row is None:
+            return JournalJob(self, update_id, key)
+        return JournalJob(self, update_id, key, row[0], json.loads(row[1]) if row[1] else None)
+
+    def record(self, update_id, key, state, data=None):
+        self._db().execute(
+            'INSERT OR REPLACE INTO steps (update_id, key, state, data, updated_at) VALUES (?, ?, ?, ?, ?)',
+            (update_id, key, state, json.dumps(data) if data is not None else None, time.time())
+        )
+
+    def download_dirs(self):
+        """Directories holding downloads that unfinished jobs still need"""
+        rows = self._db().execute("SELECT data FROM steps WHERE state = 'downloaded'").fetchall()
+        return {Path(file_path).parent for (data,) in rows for file_path in json.loads(data)}
+
+    def commit_offset(self, update_id):
+        """Note the committed update id; it reaches the disk at the next flush"""
+        self.committed = update_id
+        if time.monotonic() - self.last_flush < self.commit_interval:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()  # No event loop to block
+            return
+        committed, self.committed = self.committed, None
+        self.last_flush = time.monotonic()
+        self.flusher = loop.create_task(self._flush_in_thread(committed))
+
+    async def _flush_in_thread(self, committed):
+        try:
+            await asyncio.to_thread(self._write_offset, committed)
+        except Exception as e:
+            logger.warning(f"Could not write the journal offset: {e}")
+            if self.committed is None:
+                self.committed = committed  # Retried at the next flush
+
+    async def close(self):
+        """Finish any offset write in progress, then flush what is left; for shutdown"""
+        if self.flusher is not None:
+            await self.flusher
+        await asyncio.to_thread(self.flush)
+
+    def flush(self):
+        """Write the committed offset and drop journal entries it covers"""
+        self.last_flush = time.monotonic()
+        if self.committed is None:
+            return
+        self._write_offset(self.committed)
+        self.committed = None
+
+    def _write_offset(self, committed):
+        with self._transaction() as db:
+            db.execute(
+                "INSERT INTO kv (key, value) VALUES ('offset', ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), CAST(excluded.value AS INTEGER))",
+                (committed,)
+            )
+            db.execute('DELETE FROM updates WHERE done = 1 AND update_id <= ?', (committed,))
+            # Progress of updates handled elsewhere (queue workers) that never finished here
+            db.execute('DELETE FROM steps WHERE updated_at < ?', (time.time() - self.retention,))
@@ -0,0 +1,72 @@
+import logging
+import time
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# A file already uploaded to Telegram; media_type picks the send_* method to reuse it with
+CachedMedia = namedtuple('CachedMedia', ['media_type', 'file_id'])
+
+
+def cached_media_from_message(message):
+    """Pull the reusable file_id out of a sent Telegram message"""
+    if message.photo:
+        # Largest size is last; Telegram regenerates the smaller ones from it
+        return CachedMedia('photo', message.photo[-1].file_id)
+    if message.video:
+        return CachedMedia('video', message.video.file_id)
+    if message.audio:
+        return CachedMedia('audio', message.audio.file_id)
+    if message.document:
+        return CachedMedia('document', message.document.file_id)
+    return None
+
+
+class MediaCache:
+    """In-memory LRU cache of Telegram file_ids per Instagram shortcode, with TTL expiry"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # shortcode -> (stored_at, [CachedMedia])
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, shortcode):
+        """Return the cached media list for a shortcode, or None"""
+        entry = self.entries.get(shortcode)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        stored_at, media = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self.entries[shortcode]
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(shortcode)
+        self.hits += 1
+        return media
+
+    def put(self, shortcode, media):
+        """Store the uploaded media for a shortcode, evicting the least recently used"""
+        self.entries[shortcode] = (time.monotonic(), list(media))
+        self.entries.move_to_end(shortcode)
+        while len(self.entries) > self.max_entries:
+            evicted, _ = self.entries.popitem(last=False)
+            logger.debug(f"Evicted {evicted} from media cache")
+
+    def invalidate(self, shortcode):
+        """Drop a shortcode, e.g. when Telegram no longer accepts its file_ids"""
+        self.entries.pop(shortcode, None)
+
+    def stats(self):
+        """Entry count and hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,22 @@
+from collections import namedtuple
+from urllib.parse import urlparse, parse_qs
+
+# A resolved media item on Instagram's CDN; width/height are None when the source doesn't say
+MediaDescriptor = namedtuple(
+    'MediaDescriptor', ['url', 'media_type', 'width', 'height'], defaults=('photo', None, None)
+)
+
+
+def cdn_url_expiry(url):
+    """Expiry time (epoch seconds) of a signed Instagram CDN URL, or None if unsigned
+
+    Instagram signs CDN URLs with an `oe` query parameter holding the expiry
+    timestamp in hex.
+    """
+    values = parse_qs(urlparse(url).query).get('oe')
+    if not values:
+        return None
+    try:
+        return int(values[0], 16)
+    except ValueError:
+        return None
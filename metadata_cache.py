@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+
+from media_descriptor import MediaDescriptor, cdn_url_expiry
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataCache:
+    """TTL cache of resolved media descriptors per shortcode, optionally persisted to SQLite
+
+    Entries expire after the configured TTL or shortly before the earliest CDN
+    URL signature in the entry runs out, whichever comes first.
+
+    Lookups only ever touch the in-memory dict: the SQLite file is read once
+    at start-up and written behind, off the event loop. Failed resolves are
+    remembered (in memory only) for negative_ttl seconds, so a post behind a
+    login wall isn't fetched again by every fallback.
+    """
+
+    def __init__(self, max_entries, ttl, expiry_margin=300, db_path=None, negative_ttl=0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.expiry_margin = expiry_margin
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()  # shortcode -> (expires_at, [MediaDescriptor])
+        self.failures = OrderedDict()  # shortcode -> time the failure is forgotten
+        self.hits = 0
+        self.misses = 0
+
+        self.db = None
+        self.pending = {}  # shortcode -> row to write, or None to delete
+        self.writer = None
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS media_metadata ("
+                "shortcode TEXT PRIMARY KEY, descriptors TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self.db.execute("DELETE FROM media_metadata WHERE expires_at <= ?", (time.time(),))
+            self.db.commit()
+            rows = self.db.execute(
+                "SELECT shortcode, descriptors, expires_at FROM media_metadata ORDER BY expires_at DESC LIMIT ?",
+                (max_entries,)
+            ).fetchall()
+            for shortcode, descriptors, expires_at in reversed(rows):  # Freshest last, as in the LRU
+                self.entries[shortcode] = (expires_at, [MediaDescriptor(*item) for item in json.loads(descriptors)])
+
+    def _expires_at(self, descriptors):
+        expires_at = time.time() + self.ttl
+        for descriptor in descriptors:
+            signed_until = cdn_url_expiry(descriptor.url)
+            if signed_until is not None:
+                expires_at = min(expires_at, signed_until - self.expiry_margin)
+        return expires_at
+
+    def get(self, shortcode):
+        """Return cached descriptors for a shortcode, or None if missing or expired"""
+        entry = self.entries.get(shortcode)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                self.invalidate(shortcode)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(shortcode)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, shortcode, descriptors):
+        """Cache descriptors for a shortcode"""
+        self.failures.pop(shortcode, None)
+        descriptors = list(descriptors)
+        expires_at = self._expires_at(descriptors)
+        if expires_at <= time.time():
+            return
+
+        self.entries[shortcode] = (expires_at, descriptors)
+        self.entries.move_to_end(shortcode)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+        self._write_behind(shortcode, (json.dumps([list(d) for d in descriptors]), expires_at))
+
+    def mark_failed(self, shortcode):
+        """Remember that a shortcode could not be resolved"""
+        if self.negative_ttl <= 0:
+            return
+        self.failures[shortcode] = time.time() + self.negative_ttl
+        self.failures.move_to_end(shortcode)
+        while len(self.failures) > self.max_entries:
+            self.failures.popitem(last=False)
+
+    def failed(self, shortcode):
+        """Whether a shortcode failed to resolve within the last negative_ttl seconds"""
+        until = self.failures.get(shortcode)
+        if until is None:
+            return False
+        if until <= time.time():
+            del self.failures[shortcode]
+            return False
+        return True
+
+    def invalidate(self, shortcode):
+        """Drop a shortcode, e.g. when its CDN URLs stop working early"""
+        self.entries.pop(shortcode, None)
+        self._write_behind(shortcode, None)
+
+    def _write_behind(self, shortcode, row):
+        if self.db is None:
+            return
+        self.pending[shortcode] = row
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(self.pending)  # No event loop to block
+            self.pending = {}
+            return
+        if self.writer is None or self.writer.done():
+            self.writer = loop.create_task(self._flush())
+
+    async def _flush(self):
+        while self.pending:
+            batch, self.pending = self.pending, {}
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception as e:
+                logger.warning(f"Could not persist {len(batch)} metadata cache entries: {e}")
+
+    def _write(self, batch):
+        for shortcode, row in batch.items():
+            if row is None:
+                self.db.execute("DELETE FROM media_metadata WHERE shortcode = ?", (shortcode,))
+            else:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO media_metadata (shortcode, descriptors, expires_at) VALUES (?, ?, ?)",
+                    (shortcode, *row)
+                )
+        self.db.commit()
+
+    def stats(self):
+        """Entry count and hit/miss counters"""
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        if self.db is not None:
+            if self.pending:
+                self._write(self.pending)
+                self.pending = {}
+            self.db.close()
+            self.db = None
@@ -0,0 +1,213 @@
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds; wide enough for a multi-minute yt-dlp run or upload
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+THROUGHPUT_BUCKETS = tuple(2 ** exponent for exponent in range(14, 28, 2))  # 16KB/s .. 64MB/s
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count, per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labelnames=()):
+        super().__init__(name, description, labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """Observations bucketed by upper bound, with their sum and count, per label set"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labelnames=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            series = self.series.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the block took, whether or not it raised"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            series = {key: list(values) for key, values in self.series.items()}
+        lines = []
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(values[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Collected(_Metric):
+    """A value read from the bot when scraped: fn() returns a number, or {label values: number}"""
+
+    def __init__(self, name, description, kind, fn, labelnames=()):
+        super().__init__(name, description, labelnames)
+        self.kind = kind
+        self.fn = fn
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.warning(f"Could not collect {self.name}: {e}")
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [
+            f"{self.name}{_labels(self.labelnames, key if isinstance(key, tuple) else (key,))} {_number(number)}"
+            for key, number in value.items()
+        ]
+
+
+class MetricsRegistry:
+    """Metrics in the Prometheus text exposition format, without the client library
+
+    Counters and histograms are updated from the bot's event loop; gauges
+    and counters the bot already keeps are read through callbacks when
+    /metrics is scraped, from Flask's thread.
+    """
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, description, labelnames=()):
+        return self._add(Counter(f"{self.namespace}_{name}", description, labelnames))
+
+    def histogram(self, name, description, labelnames=(), buckets=STAGE_BUCKETS):
+        return self._add(Histogram(f"{self.namespace}_{name}", description, labelnames, buckets))
+
+    def gauge(self, name, description, fn, labelnames=()):
+        return self._add(Collected(f"{self.namespace}_{name}", description, 'gauge', fn, labelnames))
+
+    def collected_counter(self, name, description, fn, labelnames=()):
+        return self._add(Collected(f"{self.namespace}_{name}", description, 'counter', fn, labelnames))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    async def serve(self, port, host='0.0.0.0'):
+        """Answer GET /metrics over plain HTTP, for a process without a web server of its own"""
+        async def handle(reader, writer):
+            try:
+                request_line = await reader.readline()
+                while await reader.readline() not in (b'\r\n', b'\n', b''):
+                    pass  # Headers
+                parts = request_line.split()
+                if len(parts) >= 2 and parts[1].split(b'?')[0] == b'/metrics':
+                    status, body = '200 OK', self.render().encode()
+                else:
+                    status, body = '404 Not Found', b''
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                    f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+            except Exception as e:
+                logger.warning(f"Metrics request failed: {e}")
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle, host, port)
+
+
+class PipelineMetrics(MetricsRegistry):
+    """Where the time of a request goes: per-stage latency, throughput and fallbacks"""
+
+    def __init__(self, namespace='instagram_bot'):
+        super().__init__(namespace)
+        self.stages = self.histogram(
+            'stage_seconds', 'Time spent in each pipeline stage', ['stage']
+        )
+        self.throughput = self.histogram(
+            'download_bytes_per_second', 'Media download throughput per file', buckets=THROUGHPUT_BUCKETS
+        )
+        self.fallbacks = self.counter(
+            'fallbacks_total', 'Times a stage failed and the next method was tried', ['fallback']
+        )
+
+    def stage(self, name):
+        """Context manager timing one pipeline stage"""
+        return self.stages.time(stage=name)
+
+    def fallback(self, name):
+        self.fallbacks.inc(fallback=name)
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressMessage:
+    """One status message per request, edited in place as the pipeline advances
+
+    Intermediate updates are debounced: edits closer together than
+    min_interval collapse into one, showing only the latest text. finish()
+    always edits immediately.
+    """
+
+    def __init__(self, sender, chat_id, title, min_interval):
+        self.sender = sender
+        self.chat_id = chat_id
+        self.title = title
+        self.min_interval = min_interval
+
+        self.message = None
+        self.text = None
+        self.pending = None
+        self.last_edit = 0.0
+        self.flush_task = None
+        self.downloads = {}
+
+    def _format(self, status):
+        return f"{self.title}\n\n{status}"
+
+    async def start(self, status):
+        """Send the status message"""
+        self.text = self._format(status)
+        self.message = await self.sender.send_message(chat_id=self.chat_id, text=self.text)
+        self.last_edit = time.monotonic()
+
+    def update(self, status):
+        """Show a new status soon, without waiting for the edit"""
+        text = self._format(status)
+        if self.message is None or text == self.text:
+            return
+        self.pending = text
+        if self.flush_task is None or self.flush_task.done():
+            delay = max(0.0, self.last_edit + self.min_interval - time.monotonic())
+            self.flush_task = asyncio.create_task(self._flush_after(delay))
+
+    async def _flush_after(self, delay):
+        await asyncio.sleep(delay)
+        # update() doesn't schedule another flush while this one edits, so catch up with it here
+        while self.pending != self.text:
+            if not await self._edit(self.pending):
+                return
+            await asyncio.sleep(max(0.0, self.last_edit + self.min_interval - time.monotonic()))
+
+    def report_download(self, key, received, total):
+        """Streaming download callback: shows overall percentage across files"""
+        self.downloads[key] = (received, total)
+        received_bytes = sum(r for r, _ in self.downloads.values())
+        total_bytes = sum(t for _, t in self.downloads.values() if t)
+        if total_bytes and all(t for _, t in self.downloads.values()):
+            self.update(f"⬇️ Downloading... {min(100, received_bytes * 100 // total_bytes)}%")
+        else:
+            self.update(f"⬇️ Downloading... {received_bytes / (1024 * 1024):.1f}MB")
+
+    async def finish(self, status):
+        """Show the final status right away, dropping any pending update"""
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        text = self._format(status)
+        if self.message is None:
+            await self.sender.send_message(chat_id=self.chat_id, text=text)
+            return
+        await self._edit(text)
+
+    async def _edit(self, text):
+        """Edit the message to text; returns False if the edit failed"""
+        if text is None or text == self.text:
+            return True
+        try:
+            await self.sender.edit_message_text(
+                chat_id=self.chat_id,
+                message_id=self.message.message_id,
+                text=text
+            )
+            self.text = text
+            self.last_edit = time.monotonic()
+            return True
+        except Exception as e:
+            logger.warning(f"Could not update progress message: {e}")
+            return False
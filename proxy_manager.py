@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import random
+import time
+from urllib.parse import quote, urlparse
+
+from http_client import build_client
+
+logger = logging.getLogger(__name__)
+
+# Where Instagram sends clients it wants to log in or verify
+_LOGIN_WALL_PATHS = ('/accounts/login', '/challenge')
+
+
+class Proxy:
+    """One upstream proxy: its own connection pool and a rolling health score"""
+
+    def __init__(self, url):
+        self.url = url
+        self.latency = None  # Moving average, seconds
+        self.error_rate = 0.0  # Moving average of failed requests
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.client = None
+
+    @property
+    def label(self):
+        """host:port, without credentials, for logs and stats"""
+        parsed = urlparse(self.url)
+        return f"{parsed.hostname}:{parsed.port}" if parsed.port else parsed.hostname
+
+    @property
+    def weight(self):
+        """Selection weight: reliable, fast proxies are picked more often"""
+        latency = self.latency if self.latency is not None else 1.0
+        return max(0.01, (1 - self.error_rate) ** 2 / max(latency, 0.05))
+
+    def ejected(self, now):
+        return now < self.ejected_until
+
+
+class ProxyPool:
+    """Weighted, self-healing pool of outbound proxies for Instagram traffic
+
+    Proxies are picked at random in proportion to their score (success
+    rate and latency). A proxy that gets a 429 or a login wall is ejected
+    for PROXY_EJECT_SECONDS, doubling on repeat offences; background probes
+    keep scores fresh and bring recovered proxies back early.
+    """
+
+    def __init__(self, config, proxies=None, username=None, password=None, headers=None):
+        self.config = config
+        self.headers = headers or {}
+        self.proxies = [
+            Proxy(self._with_credentials(entry, username, password))
+            for entry in (proxies or []) if entry.strip()
+        ]
+        self.prober = None
+
+    @classmethod
+    def from_config(cls, config, headers=None):
+        return cls(config, config.PROXY_LIST, config.PROXY_USERNAME, config.PROXY_PASSWORD, headers)
+
+    @staticmethod
+    def _with_credentials(entry, username, password):
+        entry = entry.strip()
+        if '://' not in entry:
+            entry = f"http://{entry}"
+        if username and '@' not in entry:
+            scheme, address = entry.split('://', 1)
+            entry = f"{scheme}://{quote(username, safe='')}:{quote(password or '', safe='')}@{address}"
+        return entry
+
+    def covers(self, url):
+        """Whether requests to url should go through a proxy"""
+        if not self.proxies:
+            return False
+        host = urlparse(url).hostname or ''
+        return any(host == domain or host.endswith('.' + domain) for domain in self.config.PROXY_HOSTS)
+
+    def choose(self, exclude=()):
+        """Pick a healthy proxy weighted by score, or None if none is available"""
+        now = time.monotonic()
+        candidates = [proxy for proxy in self.proxies if not proxy.ejected(now) and proxy not in exclude]
+        if not candidates:
+            return None
+        return random.choices(candidates, weights=[proxy.weight for proxy in candidates])[0]
+
+    def client(self, proxy):
+        """The proxy's own pooled httpx client"""
+        if proxy.client is None:
+            proxy.client = build_client(self.config, self.headers, proxies=proxy.url)
+        return proxy.client
+
+    def record(self, proxy, ok, latency=None):
+        """Fold one request outcome into the proxy's moving averages"""
+        alpha = self.config.PROXY_SCORE_DECAY
+        proxy.error_rate = (1 - alpha) * proxy.error_rate + alpha * (0.0 if ok else 1.0)
+        if ok and latency is not None:
+            proxy.latency = latency if proxy.latency is None else (1 - alpha) * proxy.latency + alpha * latency
+        if ok:
+            proxy.ejections = 0
+
+    def eject(self, proxy, reason):
+        """Take a proxy out of rotation, for longer each time it is caught again"""
+        seconds = self.config.PROXY_EJECT_SECONDS * 2 ** min(proxy.ejections, 5)
+        proxy.ejected_until = time.monotonic() + seconds
+        proxy.ejections += 1
+        self.record(proxy, False)
+        logger.warning(f"Ejecting proxy {proxy.label} for {seconds}s: {reason}")
+
+    def observe(self, proxy, response, latency):
+        """Score a response; returns False if the proxy was blocked and the request should be retried"""
+        if response.status_code == 429:
+            self.eject(proxy, "rate limited (429)")
+            return False
+        if response.url.path.startswith(_LOGIN_WALL_PATHS):
+            self.eject(proxy, "redirected to a login wall")
+            return False
+        self.record(proxy, response.status_code < 500, latency)
+        return True
+
+    def observe_error(self, proxy, error):
+        """Score a yt-dlp run from its error message (None on success)"""
+        if error is None:
+            self.record(proxy, True)
+        elif '429' in error or 'login' in error.lower():
+            self.eject(proxy, error.splitlines()[0][:200])
+        else:
+            self.record(proxy, False)
+
+    def start(self):
+        """Start background health probes in the running event loop"""
+        if self.proxies and (self.prober is None or self.prober.done()):
+            self.prober = asyncio.create_task(self._probe_loop())
+
+    async def _probe_loop(self):
+        while True:
+            await asyncio.gather(*(self.probe(proxy) for proxy in self.proxies))
+            await asyncio.sleep(self.config.PROXY_PROBE_INTERVAL)
+
+    async def probe(self, proxy):
+        """Fetch PROXY_PROBE_URL through a proxy; a clean answer reinstates an ejected proxy"""
+        started = time.monotonic()
+        try:
+            response = await self.client(proxy).get(self.config.PROXY_PROBE_URL)
+        except Exception as e:
+            self.record(proxy, False)
+            logger.debug(f"Probe through {proxy.label} failed: {e}")
+            return
+        was_ejected = proxy.ejected(time.monotonic())
+        if self.observe(proxy, response, time.monotonic() - started) and response.status_code < 400 and was_ejected:
+            proxy.ejected_until = 0.0
+            logger.info(f"Proxy {proxy.label} passed its probe, back in rotation")
+
+    def stats(self):
+        """Per-proxy health, for /status"""
+        now = time.monotonic()
+        return {
+            'total': len(self.proxies),
+            'healthy': sum(1 for proxy in self.proxies if not proxy.ejected(now)),
+            'proxies': [
+                {
+                    'proxy': proxy.label,
+                    'ejected': proxy.ejected(now),
+                    'error_rate': round(proxy.error_rate, 3),
+                    'latency': round(proxy.latency, 3) if proxy.latency is not None else None,
+                }
+                for proxy in self.proxies
+            ],
+        }
+
+    async def aclose(self):
+        if self.prober is not None:
+            self.prober.cancel()
+        for proxy in self.proxies:
+            if proxy.client is not None:
+                await proxy.client.aclose()
+                proxy.client = None
@@ -1,17 +1,36 @@
 import asyncio
 import logging
 import os
-import re
-import subprocess
 import tempfile
 import json
-import requests
 import time
+import aiofiles
 import random
+from contextlib import ExitStack
 from pathlib import Path
 from urllib.parse import urlparse, parse_qs, unquote
-from telegram import Bot
+from telegram import Bot, InputMediaPhoto, InputMediaVideo, Message, Update
+from telegram.error import TelegramError
 from config import Config
+from dispatcher import UpdateDispatcher
+from http_client import AsyncHTTPClient
+from ytdlp_runner import YtDlpRunner
+from ytdlp_engine import YtDlpEngine
+from media_cache import MediaCache, cached_media_from_message
+from coalescer import RequestCoalescer
+from media_descriptor import MediaDescriptor
+from metadata_cache import MetadataCache
+from html_extractor import extract_media
+from url_router import find_urls
+from send_scheduler import SendScheduler, ScheduledBot, PRIORITY_MEDIA
+from stream_relay import StreamRelay, RelayFile
+from scratch import ScratchSpace
+from video_processor import VideoProcessor
+from proxy_manager import ProxyPool
+from s3_storage import storage_from_config
+from progress import ProgressMessage
+from journal import UpdateJournal
+from metrics import PipelineMetrics
 
 # Enable logging
 logging.basicConfig(
@@ -24,188 +43,237 @@ class RobustInstagramBot:
         self.bot = Bot(token=token)
         self.last_update_id = 0
         self.config = Config()
-        self.temp_dir = Path(self.config.TEMP_DIR)
-        self.temp_dir.mkdir(exist_ok=True)
         
-        # Session for persistent cookies
-        self.session = requests.Session()
-        self.session.headers.update({
+        # Accepted updates and how far each link got, so a restart resumes instead of starting over
+        self.journal = UpdateJournal(
+            self.config.JOURNAL_DB,
+            self.config.JOURNAL_COMMIT_INTERVAL,
+            self.config.JOURNAL_MAX_ATTEMPTS,
+            self.config.JOB_RETENTION
+        )
+        
+        # Per-job scratch directories under a disk quota; leftovers of a previous run are swept
+        # now, except downloads that interrupted updates still need
+        self.scratch = ScratchSpace(
+            self.config.TEMP_DIR,
+            self.config.SCRATCH_QUOTA,
+            self.config.SCRATCH_MAX_AGE,
+            self.config.SCRATCH_SWEEP_INTERVAL,
+            self.config.DOWNLOAD_TIMEOUT,
+            memory_root=self.config.SCRATCH_TMPFS_DIR,
+            memory_quota=self.config.SCRATCH_TMPFS_QUOTA,
+            keep=self.journal.download_dirs()
+        )
+        
+        # All outbound sends/edits are queued and rate limited (global, per chat, per group)
+        self.send_scheduler = SendScheduler(self.config)
+        self.sender = ScheduledBot(self.bot, self.send_scheduler)
+        
+        # Bot-wide cap on simultaneous media downloads across all posts
+        self.download_slots = asyncio.Semaphore(self.config.MAX_PARALLEL_DOWNLOADS)
+        
+        # yt-dlp runs in-process on warm worker instances; the CLI runner is the
+        # fallback when the yt_dlp package can't be imported
+        self.ytdlp_engine = YtDlpEngine(self.config.YTDLP_WORKERS, self.config.YTDLP_TIMEOUT)
+        self.ytdlp = YtDlpRunner(self.config.YTDLP_WORKERS, self.config.YTDLP_TIMEOUT)
+        
+        # Telegram file_ids of media already uploaded, keyed by shortcode
+        self.media_cache = MediaCache(self.config.MEDIA_CACHE_SIZE, self.config.MEDIA_CACHE_TTL)
+        
+        # Concurrent requests for one post share a single download; files are
+        # removed once the last chat waiting on them has been served
+        self.coalescer = RequestCoalescer(on_release=self.cleanup_download)
+        
+        # Resolved CDN URLs per shortcode, valid until their signatures expire
+        self.metadata_cache = MetadataCache(
+            self.config.METADATA_CACHE_SIZE,
+            self.config.METADATA_CACHE_TTL,
+            db_path=self.config.METADATA_CACHE_DB,
+            negative_ttl=self.config.METADATA_NEGATIVE_TTL
+        )
+        # Concurrent resolves of one post share a single page/API round trip
+        self.resolver = RequestCoalescer()
+        
+        # Pooled async client for persistent cookies and keep-alive connections;
+        # Instagram traffic is spread over PROXY_LIST when one is configured
+        headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
             'Accept-Language': 'en-US,en;q=0.5',
             'Accept-Encoding': 'gzip, deflate',
             'Connection': 'keep-alive',
             'Referer': 'https://www.instagram.com/',
-        })
+        }
+        self.proxy_pool = ProxyPool.from_config(self.config, headers)
+        self.http = AsyncHTTPClient(headers=headers, proxy_pool=self.proxy_pool)
+        self.relay = StreamRelay(self.http, token, self.config)
+        self.video_processor = VideoProcessor(self.config)
+        
+        # Finished downloads are copied to S3 when configured, shared by every replica
+        self.storage = storage_from_config(self.config)
+        self.archiving = {}  # job dir -> pending storage upload
+        
+        # Updates from different chats run in parallel, bounded by MAX_CONCURRENT_DOWNLOADS
+        self.dispatcher = UpdateDispatcher(
+            self.handle_update,
+            self.config.MAX_CONCURRENT_DOWNLOADS,
+            on_commit=self.commit_update_id
+        )
         
+        # Stage latencies, fallbacks and queue depths in Prometheus format
+        self.metrics = PipelineMetrics()
+        self.register_metrics()
+        
+    def register_metrics(self):
+        """Expose the counters and queues the bot already keeps alongside the stage metrics"""
+        self.metrics.collected_counter(
+            'cache_hits_total', 'Lookups answered from a cache', lambda: self.cache_counts('hits'), ['cache']
+        )
+        self.metrics.collected_counter(
+            'cache_misses_total', 'Lookups that missed a cache', lambda: self.cache_counts('misses'), ['cache']
+        )
+        self.metrics.collected_counter(
+            'coalesced_requests_total', 'Requests that joined a download already in flight',
+            lambda: self.coalescer.coalesced
+        )
+        self.metrics.gauge('updates_in_flight', 'Updates dispatched and not yet finished', lambda: self.dispatcher.active)
+        self.metrics.gauge('downloads_in_flight', 'Distinct downloads running', lambda: self.coalescer.in_flight)
+        self.metrics.gauge(
+            'send_queue_depth', 'Telegram calls waiting for a rate-limit slot',
+            lambda: self.send_scheduler.stats()['queued']
+        )
+        self.metrics.gauge(
+            'scratch_bytes', 'Scratch space on disk: used, reserved by jobs and quota',
+            lambda: {kind: value for kind, value in self.scratch.stats().items() if kind in ('used', 'reserved', 'quota')},
+            ['kind']
+        )
+    
+    def cache_counts(self, field):
+        """Hits or misses of each cache, for /metrics"""
+        counts = {
+            'media': self.media_cache.stats()[field],
+            'metadata': self.metadata_cache.stats()[field],
+        }
+        if self.storage.enabled:
+            counts['storage'] = self.storage.stats()[field]
+        return counts
+    
+    def commit_update_id(self, update_id):
+        """Record the highest update id with every earlier update fully processed"""
+        self.last_update_id = update_id
+        self.journal.commit_offset(update_id)
+    
     async def get_updates(self):
         """Get updates from Telegram"""
         try:
-            updates = await self.bot.get_updates(offset=self.last_update_id + 1, timeout=30)
+            # Offset past everything already dispatched, even if still in flight
+            updates = await self.bot.get_updates(offset=self.dispatcher.next_offset, timeout=30)
             return updates
         except Exception as e:
             logger.error(f"Error getting updates: {e}")
             return []
     
-    def is_instagram_url(self, text):
-        """Check if text contains Instagram URL"""
-        instagram_patterns = [
-            r'https?://(?:www\.)?instagram\.com/p/[a-zA-Z0-9_-]+/?',
-            r'https?://(?:www\.)?instagram\.com/reel/[a-zA-Z0-9_-]+/?',
-            r'https?://(?:www\.)?instagram\.com/tv/[a-zA-Z0-9_-]+/?',
-            r'https?://(?:www\.)?instagram\.com/stories/[^/]+/\d+/?',
-            r'https?://(?:www\.)?instagram\.com/[^/]+/?'
-        ]
+    async def accept_updates(self, updates, by_id=False):
+        """Journal new updates, then dispatch them
         
-        for pattern in instagram_patterns:
-            if re.search(pattern, text):
-                return True
-        return False
+        The next get_updates call confirms these to Telegram, so they must be
+        on disk before it is made. Webhook updates can arrive out of order and
+        are deduplicated by id (by_id) rather than by the highest id seen.
+        """
+        updates = [update for update in updates if not self.dispatcher.seen(update, by_id)]
+        await self.journal.accept(updates)
+        for update in updates:
+            self.dispatcher.submit(update, by_id)
     
-    def extract_shortcode(self, url):
-        """Extract shortcode from Instagram URL"""
-        patterns = [
-            r'instagram\.com/p/([a-zA-Z0-9_-]+)',
-            r'instagram\.com/reel/([a-zA-Z0-9_-]+)',
-            r'instagram\.com/tv/([a-zA-Z0-9_-]+)',
-            r'instagram\.com/stories/[^/]+/(\d+)',
-            r'instagram\.com/([^/]+)'
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, url)
-            if match:
-                return match.group(1)
-        return None
+    def resume_journal(self):
+        """Continue from the journaled offset, re-running updates a previous run left unfinished"""
+        pending = [Update.de_json(payload, self.bot) for payload in self.journal.pending()]
+        if pending:
+            logger.info(f"Resuming {len(pending)} interrupted update(s)")
+        self.dispatcher.resume(self.journal.offset, pending, self.journal.last_accepted)
+        self.last_update_id = self.dispatcher.committed_id
     
-    def detect_content_type(self, url):
-        """Detect if URL is for video, photo, or story"""
-        if '/stories/' in url:
-            return 'story'
-        elif '/reel/' in url or '/tv/' in url:
-            return 'video'
-        elif '/p/' in url:
-            return 'post'  # Could be photo or video
-        else:
-            return 'unknown'
+    async def handle_update(self, update):
+        """Process an update and mark it done in the journal; if the process dies first, it is resumed"""
+        await self.process_update(update)
+        await self.journal.finish(update.update_id)
     
-    def extract_photo_urls_from_html(self, url):
-        """Extract photo URLs directly from Instagram page HTML"""
+    async def extract_photo_urls_from_html(self, url, shortcode=None):
+        """Extract media descriptors directly from Instagram page HTML"""
         try:
             logger.info(f"Extracting photo URLs from: {url}")
             
             # Get the Instagram page
-            response = self.session.get(url, timeout=30)
+            with self.metrics.stage('html_fetch'):
+                response = await self.http.get(url)
             response.raise_for_status()
             
             html_content = response.text
             logger.info(f"Got HTML content, length: {len(html_content)}")
             
-            photo_urls = []
-            
-            # First, try to find the main JSON data structure
-            shared_data_match = re.search(r'<script type="text/javascript">window\._sharedData = (.*?);</script>', html_content)
-            if shared_data_match:
-                try:
-                    shared_data = json.loads(shared_data_match.group(1))
-                    logger.info("Found _sharedData, extracting post info...")
-                    
-                    # Navigate through the JSON structure to find post media
-                    if 'entry_data' in shared_data and 'PostPage' in shared_data['entry_data']:
-                        post_data = shared_data['entry_data']['PostPage'][0]['graphql']['shortcode_media']
-                        
-                        # Check if it's a carousel (multiple images)
-                        if 'edge_sidecar_to_children' in post_data:
-                            edges = post_data['edge_sidecar_to_children']['edges']
-                            for edge in edges:
-                                node = edge['node']
-                                if 'display_url' in node:
-                                    photo_urls.append(node['display_url'])
-                                    logger.info(f"Found carousel photo: {node['display_url']}")
-                        else:
-                            # Single image/video
-                            if 'display_url' in post_data:
-                                photo_urls.append(post_data['display_url'])
-                                logger.info(f"Found single photo: {post_data['display_url']}")
-                                
-                except Exception as e:
-                    logger.error(f"Error parsing _sharedData: {e}")
+            # Single pass over the page's embedded JSON, falling back to raw URL literals
+            with self.metrics.stage('html_parse'):
+                media = extract_media(html_content, shortcode)
             
-            # If no URLs found from _sharedData, try alternative methods
-            if not photo_urls:
-                logger.info("No URLs from _sharedData, trying alternative extraction...")
-                
-                # Look for specific Instagram post patterns
-                patterns = [
-                    r'"display_url":"([^"]+)"',
-                    r'"src":"([^"]+\.jpg[^"]*)"',
-                    r'"src":"([^"]+\.png[^"]*)"',
-                    r'"src":"([^"]+\.webp[^"]*)"'
-                ]
-                
-                for pattern in patterns:
-                    matches = re.findall(pattern, html_content, re.IGNORECASE)
-                    for match in matches:
-                        if isinstance(match, str) and match.startswith('http'):
-                            # Clean up the URL
-                            clean_url = match.split('\\u0026')[0]  # Remove escaped characters
-                            clean_url = clean_url.replace('\\u0026', '&')
-                            clean_url = clean_url.replace('\\/', '/')
-                            
-                            # Filter out Instagram's own assets and logos
-                            if (clean_url not in photo_urls and 
-                                any(ext in clean_url.lower() for ext in ['.jpg', '.png', '.webp']) and
-                                'instagram' not in clean_url.lower() and
-                                'logo' not in clean_url.lower() and
-                                'icon' not in clean_url.lower() and
-                                'cdninstagram' in clean_url.lower()):  # Only Instagram CDN URLs
-                                
-                                photo_urls.append(clean_url)
-                                logger.info(f"Found photo URL: {clean_url}")
-            
-            # Remove duplicates and filter out any remaining Instagram assets
-            unique_urls = []
-            for url in list(set(photo_urls)):
-                # Additional filtering to exclude Instagram's own assets
-                if ('instagram' not in url.lower() or 'cdninstagram' in url.lower()) and \
-                   'logo' not in url.lower() and \
-                   'icon' not in url.lower() and \
-                   'brand' not in url.lower():
-                    unique_urls.append(url)
-            
-            logger.info(f"Found {len(unique_urls)} filtered photo URLs")
-            return unique_urls
+            logger.info(f"Found {len(media)} filtered photo URLs")
+            return media
             
         except Exception as e:
             logger.error(f"Error extracting photo URLs: {e}")
             return []
     
-    async def download_photo_from_url(self, photo_url, shortcode, index=0):
-        """Download a single photo from URL"""
+    async def download_photo_from_url(self, photo_url, shortcode, job_dir, index=0, on_progress=None):
+        """Download a single photo from URL, streaming it to disk in chunks
+        
+        on_progress, if given, is called as on_progress(index, received, total)
+        after each chunk; total is 0 when the server sends no Content-Length.
+        """
+        part_path = None
         try:
             logger.info(f"Downloading photo from: {photo_url}")
+            started = time.monotonic()
             
-            # Download the image
-            response = self.session.get(photo_url, timeout=30)
-            response.raise_for_status()
-            
-            # Determine file extension
-            content_type = response.headers.get('content-type', '')
-            if 'jpeg' in content_type or 'jpg' in content_type:
-                ext = '.jpg'
-            elif 'png' in content_type:
-                ext = '.png'
-            elif 'webp' in content_type:
-                ext = '.webp'
-            else:
-                ext = '.jpg'  # Default
-            
-            # Save the file
-            filename = f"instagram_{shortcode}_{index}{ext}"
-            file_path = self.temp_dir / filename
+            async with self.http.stream('GET', photo_url) as response:
+                response.raise_for_status()
+                
+                # Reject early when the server announces an oversized body
+                content_length = int(response.headers.get('content-length') or 0)
+                if content_length > self.config.MAX_FILE_SIZE:
+                    logger.warning(f"Photo too large ({content_length // (1024 * 1024)}MB), skipping")
+                    return None
+                
+                # Determine file extension
+                content_type = response.headers.get('content-type', '')
+                if 'jpeg' in content_type or 'jpg' in content_type:
+                    ext = '.jpg'
+                elif 'png' in content_type:
+                    ext = '.png'
+                elif 'webp' in content_type:
+                    ext = '.webp'
+                elif 'mp4' in content_type:
+                    ext = '.mp4'
+                else:
+                    ext = '.jpg'  # Default
+                
+                # Stream into a .part file so a half-written download is never picked up
+                filename = f"instagram_{shortcode}_{index}{ext}"
+                file_path = job_dir / filename
+                part_path = file_path.with_name(filename + '.part')
+                
+                received = 0
+                async with aiofiles.open(part_path, 'wb') as f:
+                    async for chunk in response.aiter_bytes(self.config.DOWNLOAD_CHUNK_SIZE):
+                        received += len(chunk)
+                        if received > self.config.MAX_FILE_SIZE:
+                            logger.warning(f"Photo exceeded {self.config.MAX_FILE_SIZE // (1024 * 1024)}MB while downloading, aborting")
+                            return None
+                        await f.write(chunk)
+                        if on_progress:
+                            on_progress(index, received, content_length)
             
-            with open(file_path, 'wb') as f:
-                f.write(response.content)
+            part_path.replace(file_path)
+            part_path = None
+            self.metrics.throughput.observe(received / max(time.monotonic() - started, 0.001))
             
             file_size = file_path.stat().st_size // (1024 * 1024)  # MB
             logger.info(f"Photo downloaded: {file_path} ({file_size}MB)")
@@ -215,60 +283,145 @@ class RobustInstagramBot:
         except Exception as e:
             logger.error(f"Error downloading photo: {e}")
             return None
+        finally:
+            if part_path is not None:
+                part_path.unlink(missing_ok=True)
+    
+    async def download_photos(self, media, shortcode, job_dir, on_progress=None):
+        """Download carousel photos concurrently, keeping carousel order"""
+        # Per-post fan-out limit on top of the bot-wide download cap
+        fanout = asyncio.Semaphore(self.config.CAROUSEL_FANOUT)
+        
+        async def download(index, item):
+            async with fanout, self.download_slots:
+                return await self.download_photo_from_url(item.url, shortcode, job_dir, index, on_progress)
+        
+        results = await asyncio.gather(*(
+            download(i, item)
+            for i, item in enumerate(media[:self.config.MAX_CAROUSEL_ITEMS])
+        ))
+        return [file_path for file_path in results if file_path]
     
-    async def download_instagram_content(self, url):
+    async def download_instagram_content(self, parsed, on_progress=None):
         """Download Instagram content using multiple methods"""
         try:
-            shortcode = self.extract_shortcode(url)
-            content_type = self.detect_content_type(url)
+            url = parsed.url
+            shortcode = parsed.key
+            content_type = parsed.content_type
             
             if not shortcode:
                 return None, "Could not extract Instagram post ID"
             
             logger.info(f"Downloading Instagram {content_type}: {shortcode}")
             
-            # For photos, try direct extraction first
+            # For photos, try direct extraction first; photo jobs may use the memory tier
             if content_type == 'post':
-                photo_urls = self.extract_photo_urls_from_html(url)
-                
-                if photo_urls:
-                    logger.info(f"Found {len(photo_urls)} photo URLs, downloading...")
-                    downloaded_files = []
-                    
-                    for i, photo_url in enumerate(photo_urls[:5]):  # Limit to 5 photos
-                        file_path = await self.download_photo_from_url(photo_url, shortcode, i)
-                        if file_path:
-                            downloaded_files.append(file_path)
-                    
-                    if downloaded_files:
-                        return downloaded_files, None
-                    else:
-                        logger.warning("Direct photo extraction failed, trying alternative method...")
-                
-                # Try alternative method using Instagram's public API
-                logger.info("Trying alternative photo extraction method...")
-                alt_photo_urls = await self.extract_photos_from_api(shortcode)
-                if alt_photo_urls:
-                    logger.info(f"Found {len(alt_photo_urls)} photo URLs via API, downloading...")
-                    downloaded_files = []
-                    
-                    for i, photo_url in enumerate(alt_photo_urls[:5]):
-                        file_path = await self.download_photo_from_url(photo_url, shortcode, i)
-                        if file_path:
-                            downloaded_files.append(file_path)
-                    
-                    if downloaded_files:
-                        return downloaded_files, None
+                files, _ = await self.in_scratch(
+                    shortcode, lambda job_dir: self.download_post_photos(parsed, job_dir, on_progress), memory=True
+                )
+                if files:
+                    self.archive_download(parsed, files)
+                    return files, None
+                self.metrics.fallback('api_to_ytdlp')
             
             # Fallback to yt-dlp for videos or if direct extraction failed
-            return await self.download_with_ytdlp(url, shortcode, content_type)
+            files, error = await self.in_scratch(
+                shortcode, lambda job_dir: self.download_with_ytdlp(url, shortcode, content_type, job_dir)
+            )
+            if files:
+                self.archive_download(parsed, files)
+            return files, error
                 
         except Exception as e:
             logger.error(f"Error downloading Instagram content: {e}")
             return None, f"Error downloading Instagram content: {str(e)}"
     
+    def archive_download(self, parsed, files):
+        """Copy a finished download to shared storage in the background"""
+        if not self.storage.enabled or not parsed.cacheable:
+            return
+        # Only what can later be handed to Telegram by URL is worth keeping
+        items = [(file_path, self.media_kind(file_path)) for file_path in files]
+        if any(kind not in ('photo', 'video') for _, kind in items) or \
+                any(file_path.stat().st_size > self.config.MAX_FILE_SIZE for file_path in files):
+            return
+        
+        job_dir = files[0].parent
+        upload = asyncio.create_task(self.storage.store(parsed.key, items))
+        self.archiving[job_dir] = upload
+        upload.add_done_callback(lambda _: self.archiving.pop(job_dir, None))
+    
+    async def in_scratch(self, shortcode, download, memory=False):
+        """Run download(job_dir) in a new scratch directory, releasing it unless files came back
+        
+        Directories holding files are released by cleanup_download after delivery.
+        """
+        job_dir = await self.scratch.acquire(shortcode, self.config.SCRATCH_JOB_RESERVE, memory)
+        files = None
+        try:
+            files, error = await download(job_dir)
+            return files, error
+        finally:
+            if not files:
+                self.scratch.release(job_dir)
+    
+    async def download_post_photos(self, parsed, job_dir, on_progress=None):
+        """Download a post's photos from its page or the API into job_dir"""
+        shortcode = parsed.key
+        
+        # Recently resolved: skip the page and API round trips
+        cached_media = self.metadata_cache.get(shortcode)
+        if cached_media:
+            logger.info(f"Using {len(cached_media)} cached media URLs for {shortcode}")
+            downloaded_files = await self.download_photos(cached_media, shortcode, job_dir, on_progress)
+            
+            if downloaded_files:
+                return downloaded_files, None
+            self.metadata_cache.invalidate(shortcode)
+        
+        # Page first, then the API; shared with concurrent resolves, and failures are remembered
+        media = await self.resolve_media(parsed)
+        if not media:
+            return None, "No photos found on the post page or API"
+        
+        logger.info(f"Found {len(media)} photo URLs, downloading...")
+        downloaded_files = await self.download_photos(media, shortcode, job_dir, on_progress)
+        if downloaded_files:
+            return downloaded_files, None
+        
+        self.metadata_cache.invalidate(shortcode)
+        return None, "No photos could be downloaded"
+    
+    async def resolve_media(self, parsed):
+        """Resolve a post to CDN media descriptors without downloading anything"""
+        if parsed.kind != 'post':
+            return []
+        
+        shortcode = parsed.key
+        media = self.metadata_cache.get(shortcode)
+        if media:
+            return media
+        if self.metadata_cache.failed(shortcode):
+            return []
+        
+        async with self.resolver.share(shortcode, lambda: self.fetch_media(parsed)) as media:
+            return media
+    
+    async def fetch_media(self, parsed):
+        """Fetch a post's media descriptors from its page, falling back to the API"""
+        shortcode = parsed.key
+        media = await self.extract_photo_urls_from_html(parsed.url, shortcode)
+        if not media:
+            self.metrics.fallback('html_to_api')
+            media = await self.extract_photos_from_api(shortcode)
+        if media:
+            self.metadata_cache.put(shortcode, media)
+        else:
+            self.metadata_cache.mark_failed(shortcode)
+        return media
+    
     async def extract_photos_from_api(self, shortcode):
-        """Extract photos using Instagram's public API"""
+        """Extract photo descriptors using Instagram's public API"""
         try:
             logger.info(f"Trying Instagram API for shortcode: {shortcode}")
             
@@ -282,7 +435,8 @@ class RobustInstagramBot:
                 'X-Requested-With': 'XMLHttpRequest'
             }
             
-            response = self.session.get(api_url, headers=headers, timeout=30)
+            with self.metrics.stage('api_fetch'):
+                response = await self.http.get(api_url, headers=headers)
             
             if response.status_code == 200:
                 try:
@@ -302,14 +456,14 @@ class RobustInstagramBot:
                                     # Get the highest quality image
                                     candidates = media['image_versions2']['candidates']
                                     if candidates:
-                                        photo_urls.append(candidates[0]['url'])
+                                        photo_urls.append(self.descriptor_from_candidate(candidates[0]))
                                         logger.info(f"Found carousel photo: {candidates[0]['url']}")
                         else:
                             # Single media
                             if 'image_versions2' in item and 'candidates' in item['image_versions2']:
                                 candidates = item['image_versions2']['candidates']
                                 if candidates:
-                                    photo_urls.append(candidates[0]['url'])
+                                    photo_urls.append(self.descriptor_from_candidate(candidates[0]))
                                     logger.info(f"Found single photo: {candidates[0]['url']}")
                     
                     return photo_urls
@@ -325,31 +479,48 @@ class RobustInstagramBot:
             logger.error(f"Error extracting photos from API: {e}")
             return []
     
-    async def download_with_ytdlp(self, url, shortcode, content_type):
+    def descriptor_from_candidate(self, candidate):
+        """Build a media descriptor from an API image candidate"""
+        return MediaDescriptor(candidate['url'], 'photo', candidate.get('width'), candidate.get('height'))
+    
+    async def download_with_ytdlp(self, url, shortcode, content_type, job_dir):
         """Download using yt-dlp as fallback"""
         try:
-            output_template = str(self.temp_dir / f"instagram_ytdlp_{shortcode}.%(ext)s")
-            
-            cmd = [
-                'yt-dlp',
-                '--format', 'best[ext=mp4]/best[ext=jpg]/best[ext=png]/best',
-                '--output', output_template,
-                '--no-playlist',
-                '--no-warnings',
-                '--quiet',
-                '--no-progress',
-                url
-            ]
+            output_template = str(job_dir / f"instagram_ytdlp_{shortcode}.%(ext)s")
+            proxy = self.proxy_pool.choose()
+            started = time.monotonic()
             
-            logger.info(f"Running yt-dlp command: {' '.join(cmd)}")
+            if self.ytdlp_engine.available:
+                # Warm in-process engine: no interpreter start-up or extractor imports per request
+                logger.info(f"Running embedded yt-dlp for: {url}")
+                error_msg = await self.ytdlp_engine.download(url, output_template, proxy=proxy and proxy.url)
+            else:
+                args = [
+                    '--format', 'best[ext=mp4]/best[ext=jpg]/best[ext=png]/best',
+                    '--output', output_template,
+                    '--no-playlist',
+                    '--no-warnings',
+                    '--quiet',
+                    '--no-progress',
+                    url
+                ]
+                
+                logger.info(f"Running yt-dlp command: yt-dlp {' '.join(args)}")
+                if proxy:
+                    args[:0] = ['--proxy', proxy.url]
+                
+                result = await self.ytdlp.run(args)
+                error_msg = None if result.returncode == 0 else (result.stderr or "Unknown error")
             
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+            self.metrics.stages.observe(time.monotonic() - started, stage='ytdlp')
+            if proxy:
+                self.proxy_pool.observe_error(proxy, error_msg)
             
-            if result.returncode == 0:
+            if error_msg is None:
                 downloaded_files = []
                 
                 # Check for downloaded files
-                for file in self.temp_dir.glob(f"instagram_ytdlp_{shortcode}.*"):
+                for file in job_dir.glob(f"instagram_ytdlp_{shortcode}.*"):
                     if file.exists() and file.stat().st_size > 0:
                         file_size = file.stat().st_size // (1024 * 1024)  # MB
                         logger.info(f"yt-dlp download successful: {file} ({file_size}MB)")
@@ -360,20 +531,156 @@ class RobustInstagramBot:
                 else:
                     return None, "yt-dlp completed but no files found"
             else:
-                error_msg = result.stderr if result.stderr else "Unknown error"
                 return None, f"yt-dlp failed: {error_msg}"
                 
         except Exception as e:
             logger.error(f"yt-dlp error: {e}")
             return None, f"yt-dlp error: {str(e)}"
     
+    def media_kind(self, file_path):
+        """Telegram media type for a file, based on its extension"""
+        file_ext = file_path.suffix.lower()
+        if file_ext in ['.mp3', '.m4a', '.aac', '.wav']:
+            return 'audio'
+        elif file_ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp']:
+            return 'photo'
+        elif file_ext in ['.mp4', '.avi', '.mov', '.mkv', '.webm']:
+            return 'video'
+        return 'document'
+    
+    async def send_media_group(self, chat_id, items, caption=""):
+        """Send (media_type, media) pairs as albums of up to MEDIA_GROUP_LIMIT; returns the sent messages
+        
+        media is an open file, a Telegram file_id or an HTTP URL. Albums are split evenly since
+        Telegram rejects an album with a single item, and only the first item of
+        the first album carries the caption.
+        """
+        limit = self.config.MEDIA_GROUP_LIMIT
+        album_count = -(-len(items) // limit)
+        album_size = -(-len(items) // album_count)
+        
+        messages = []
+        for start in range(0, len(items), album_size):
+            album = []
+            for index, (media_type, media) in enumerate(items[start:start + album_size], start):
+                item_caption = caption if index == 0 else None
+                if media_type == 'video':
+                    album.append(InputMediaVideo(media, caption=item_caption, supports_streaming=True))
+                else:
+                    album.append(InputMediaPhoto(media, caption=item_caption))
+            messages.extend(await self.sender.send_media_group(chat_id=chat_id, media=album))
+        return messages
+    
+    async def send_album(self, chat_id, files, caption=""):
+        """Upload photo/video files as media groups; returns the sent messages"""
+        with ExitStack() as stack:
+            items = [
+                (self.media_kind(file_path), stack.enter_context(open(file_path, 'rb')))
+                for file_path in files
+            ]
+            logger.info(f"Sending {len(files)} files as a media group")
+            return await self.send_media_group(chat_id, items, caption)
+    
+    async def deliver_by_url(self, chat_id, media, shortcode, caption=""):
+        """Have Telegram fetch CDN URLs itself; returns False if it can't
+        
+        Telegram downloads the media directly, so our server never touches the
+        bytes. It refuses URLs it cannot fetch or that exceed its URL upload
+        limits, in which case the caller falls back to download-and-upload.
+        """
+        media = media[:self.config.MAX_CAROUSEL_ITEMS]
+        try:
+            if len(media) > 1:
+                messages = await self.send_media_group(
+                    chat_id, [(item.media_type, item.url) for item in media], caption
+                )
+            elif media[0].media_type == 'video':
+                messages = [await self.sender.send_video(chat_id=chat_id, video=media[0].url,
+                                                         caption=caption, supports_streaming=True)]
+            else:
+                messages = [await self.sender.send_photo(chat_id=chat_id, photo=media[0].url, caption=caption)]
+        except TelegramError as e:
+            logger.info(f"Telegram could not fetch media by URL, downloading instead: {e}")
+            return False
+        
+        logger.info(f"Sent {len(messages)} file(s) by URL")
+        uploaded = [cached_media_from_message(message) for message in messages]
+        if shortcode and all(uploaded):
+            self.media_cache.put(shortcode, uploaded)
+        return True
+    
+    async def relay_media(self, chat_id, media, shortcode, caption=""):
+        """Upload media straight from the CDN download stream; returns False if it fails
+        
+        Nothing is written to disk and the upload starts with the first chunk.
+        A flood-limit retry re-fetches the source, since the stream can't be replayed.
+        The upload holds the chat's send slot throughout, so it reports no progress:
+        status edits could only go out after it.
+        """
+        media = media[:self.config.MAX_CAROUSEL_ITEMS]
+        files = [
+            RelayFile(f"file{i}", item.url, f"instagram_{shortcode}_{i}{'.mp4' if item.media_type == 'video' else '.jpg'}")
+            for i, item in enumerate(media)
+        ]
+        if len(media) > 1:
+            method = 'sendMediaGroup'
+            album = [{'type': item.media_type, 'media': f"attach://file{i}"} for i, item in enumerate(media)]
+            album[0]['caption'] = caption
+            params = {'chat_id': chat_id, 'media': album}
+        elif media[0].media_type == 'video':
+            method = 'sendVideo'
+            files[0] = files[0]._replace(field='video')
+            params = {'chat_id': chat_id, 'caption': caption, 'supports_streaming': True}
+        else:
+            method = 'sendPhoto'
+            files[0] = files[0]._replace(field='photo')
+            params = {'chat_id': chat_id, 'caption': caption}
+        
+        try:
+            result = await self.send_scheduler.submit(
+                chat_id, lambda: self.relay.send(method, params, files), PRIORITY_MEDIA
+            )
+        except Exception as e:
+            logger.warning(f"Streaming relay failed, downloading to disk instead: {e}")
+            return False
+        
+        messages = [Message.de_json(item, self.bot) for item in (result if isinstance(result, list) else [result])]
+        logger.info(f"Relayed {len(messages)} file(s) without a temp file")
+        uploaded = [cached_media_from_message(message) for message in messages]
+        if shortcode and all(uploaded):
+            self.media_cache.put(shortcode, uploaded)
+        return True
+    
+    async def remote_media(self, parsed, shortcode, job):
+        """Media lists deliverable without a local download: shared storage first, then the CDN"""
+        if shortcode:
+            stored = await self.storage.fetch(shortcode)
+            if stored:
+                yield stored
+        media = await self.resolve_media(parsed)
+        if media:
+            await job.mark('resolved', media)
+            yield media
+    
+    async def deliver_resolved(self, chat_id, media, shortcode, caption=""):
+        """Deliver resolved CDN media without a temp file: by URL first, then by streaming relay"""
+        if self.config.DIRECT_URL_DELIVERY:
+            with self.metrics.stage('telegram_url_send'):
+                if await self.deliver_by_url(chat_id, media, shortcode, caption):
+                    return True
+        if self.config.STREAM_RELAY:
+            with self.metrics.stage('telegram_relay'):
+                if await self.relay_media(chat_id, media, shortcode, caption):
+                    return True
+        return False
+    
     async def send_media(self, chat_id, file_path, caption=""):
-        """Send media file to chat"""
+        """Send media file to chat, returning the sent message"""
         try:
             file_size = file_path.stat().st_size
             
             if file_size > self.config.MAX_FILE_SIZE:
-                await self.bot.send_message(
+                await self.sender.send_message(
                     chat_id=chat_id,
                     text=f"❌ File too large ({file_size // (1024*1024)}MB). "
                          f"Telegram limit is {self.config.MAX_FILE_SIZE // (1024*1024)}MB."
@@ -383,26 +690,26 @@ class RobustInstagramBot:
             logger.info(f"Sending file: {file_path} ({file_size // (1024*1024)}MB)")
             
             # Determine file type and send accordingly
-            file_ext = file_path.suffix.lower()
+            media_kind = self.media_kind(file_path)
             
             with open(file_path, 'rb') as file:
-                if file_ext in ['.mp3', '.m4a', '.aac', '.wav']:
+                if media_kind == 'audio':
                     # Send as audio
-                    await self.bot.send_audio(
+                    message = await self.sender.send_audio(
                         chat_id=chat_id,
                         audio=file,
                         caption=caption
                     )
-                elif file_ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp']:
+                elif media_kind == 'photo':
                     # Send as photo
-                    await self.bot.send_photo(
+                    message = await self.sender.send_photo(
                         chat_id=chat_id,
                         photo=file,
                         caption=caption
                     )
-                elif file_ext in ['.mp4', '.avi', '.mov', '.mkv', '.webm']:
+                elif media_kind == 'video':
                     # Send as video
-                    await self.bot.send_video(
+                    message = await self.sender.send_video(
                         chat_id=chat_id,
                         video=file,
                         caption=caption,
@@ -410,25 +717,318 @@ class RobustInstagramBot:
                     )
                 else:
                     # Send as document
-                    await self.bot.send_document(
+                    message = await self.sender.send_document(
                         chat_id=chat_id,
                         document=file,
                         caption=caption
                     )
             
-            # Clean up
-            file_path.unlink()
-            logger.info("File sent successfully and cleaned up")
-            return True
+            # Files are cleaned up by cleanup_download once every waiting chat is served
+            logger.info("File sent successfully")
+            return message
             
         except Exception as e:
             logger.error(f"Error sending file: {e}")
-            await self.bot.send_message(
+            await self.sender.send_message(
                 chat_id=chat_id,
                 text=f"❌ Error sending file: {str(e)}"
             )
             return False
     
+    async def handle_instagram_url(self, chat_id, parsed, update_id=None):
+        """Download a parsed Instagram URL and deliver its media to the chat"""
+        content_type = parsed.content_type
+        caption = f"📱 Downloaded from Instagram {content_type}"
+        
+        # Profiles have no stable media to cache
+        shortcode = parsed.key if parsed.cacheable else None
+        
+        job = await self.journal.job(update_id, parsed.key or parsed.url)
+        if job.state == 'sent':
+            return  # Delivered before a restart interrupted the update
+        
+        # Already uploaded once: re-send by file_id, no download or upload needed
+        cached = self.media_cache.get(shortcode) if shortcode else None
+        if cached:
+            if await self.send_cached_media(chat_id, cached, caption):
+                await job.mark('sent')
+                return
+            self.media_cache.invalidate(shortcode)
+        
+        # One status message, edited as the download advances
+        progress = ProgressMessage(
+            self.sender, chat_id,
+            f"🔗 **Instagram {content_type.title()}**",
+            self.config.PROGRESS_EDIT_INTERVAL
+        )
+        await progress.start("⏳ Processing... this may take a few moments.")
+        
+        # Downloaded before a restart: go straight to the upload
+        resumed = self.resume_job(job)
+        if resumed:
+            try:
+                await self.deliver_download(chat_id, (resumed, None), shortcode, caption, progress, job)
+            finally:
+                self.cleanup_download((resumed, None))
+            return
+        
+        # Media in shared storage or resolved to CDN URLs is delivered without touching the disk
+        if self.config.DIRECT_URL_DELIVERY or self.config.STREAM_RELAY:
+            async for media in self.remote_media(parsed, shortcode, job):
+                if await self.deliver_resolved(chat_id, media, shortcode, caption):
+                    await job.mark('sent')
+                    await progress.finish(
+                        f"🎉 **Content sent successfully!**\n"
+                        f"Sent {min(len(media), self.config.MAX_CAROUSEL_ITEMS)} file(s)."
+                    )
+                    return
+        
+        # Download content, sharing the work with concurrent requests for the same post
+        async with self.coalescer.share(
+            (parsed.kind, parsed.key),
+            lambda: self.download_instagram_content(parsed, progress.report_download)
+        ) as result:
+            await self.deliver_download(chat_id, result, shortcode, caption, progress, job)
+    
+    def resume_job(self, job):
+        """Restore what an interrupted run got done for a link; returns its downloaded files if they survived"""
+        if job.state == 'resolved':
+            self.metadata_cache.put(job.key, [MediaDescriptor(*item) for item in job.data])
+        elif job.state == 'downloaded':
+            files = [Path(file_path) for file_path in job.data]
+            if all(file_path.exists() for file_path in files):
+                logger.info(f"Resuming {job.key} from {len(files)} file(s) downloaded before a restart")
+                return files
+        return None
+    
+    async def deliver_download(self, chat_id, result, shortcode, caption, progress, job):
+        """Send downloaded files to the chat and report the outcome"""
+        files, error = result
+        
+        if files and not error:
+            await job.mark('downloaded', [str(file_path) for file_path in files])
+            progress.update(f"📤 Sending {len(files)} file(s)...")
+            
+            success_count = await self.upload_files(chat_id, files, shortcode, caption)
+            
+            if success_count > 0:
+                await job.mark('sent')
+                await progress.finish(
+                    f"🎉 **Content sent successfully!**\n"
+                    f"Sent {success_count} out of {len(files)} files."
+                )
+            else:
+                await progress.finish(
+                    "❌ **Failed to send any files**\n"
+                    "All files were too large or had errors."
+                )
+        else:
+            await progress.finish(
+                f"❌ **Download Failed**\n"
+                f"Error: {error}\n\n"
+                "Please check:\n"
+                "• The URL is correct\n"
+                "• The post is public\n"
+                "• The post contains media\n"
+                "• Try a different post"
+            )
+    
+    async def upload_files(self, chat_id, files, shortcode, caption):
+        """Upload downloaded files to the chat and cache their file_ids; returns the number sent"""
+        fitted = await self.shrink_oversized(files, shortcode)
+        try:
+            return await self.send_files(chat_id, fitted, shortcode, caption)
+        finally:
+            for file_path in set(fitted) - set(files):
+                self.video_processor.release(file_path)
+    
+    async def send_files(self, chat_id, files, shortcode, caption):
+        """Send files as albums and single messages; returns the number sent"""
+        total = len(files)
+        success_count = 0
+        uploaded = []
+        
+        # Carousels go out as albums: one API call per 10 items instead of one per file
+        album_files = [
+            file_path for file_path in files
+            if self.media_kind(file_path) in ('photo', 'video')
+            and file_path.stat().st_size <= self.config.MAX_FILE_SIZE
+        ]
+        if len(album_files) > 1:
+            try:
+                with self.metrics.stage('telegram_upload'):
+                    messages = await self.send_album(chat_id, album_files, caption)
+                success_count += len(messages)
+                uploaded.extend(cached_media_from_message(message) for message in messages)
+                files = [file_path for file_path in files if file_path not in album_files]
+                caption = ""
+            except Exception as e:
+                logger.warning(f"Media group send failed, sending files one by one: {e}")
+        
+        for file_path in files:
+            with self.metrics.stage('telegram_upload'):
+                message = await self.send_media(
+                    chat_id=chat_id,
+                    file_path=file_path,
+                    caption=caption
+                )
+            if message:
+                success_count += 1
+                uploaded.append(cached_media_from_message(message))
+        
+        # Only cache complete results so a partial send is retried next time
+        if shortcode and success_count == total and all(uploaded):
+            self.media_cache.put(shortcode, uploaded)
+        
+        return success_count
+    
+    async def shrink_oversized(self, files, shortcode):
+        """Swap videos over MAX_FILE_SIZE for compressed copies when ffmpeg is available"""
+        if not self.config.TRANSCODE_ENABLED:
+            return files
+        
+        fitted = []
+        for index, file_path in enumerate(files):
+            if self.media_kind(file_path) == 'video' \
+                    and file_path.stat().st_size > self.config.MAX_FILE_SIZE \
+                    and await self.video_processor.available():
+                key = f"{shortcode or file_path.stem}_{index}"
+                file_path = await self.video_processor.fit(file_path, key) or file_path
+            fitted.append(file_path)
+        return fitted
+    
+    async def handle_batch(self, chat_id, urls, update_id=None):
+        """Resolve every link in a message concurrently and deliver them in message order
+        
+        Downloads all start at once; each link uploads as soon as it is ready and
+        every earlier link has been delivered, so the first upload overlaps the
+        remaining downloads. One progress message is edited instead of sending
+        status messages per link.
+        """
+        progress = ProgressMessage(
+            self.sender, chat_id,
+            f"📦 **Batch of {len(urls)} Instagram links**",
+            self.config.PROGRESS_EDIT_INTERVAL
+        )
+        await progress.start("⏳ Downloading...")
+        
+        # turns[i] is set once every link before i has been delivered
+        turns = [asyncio.Event() for _ in urls]
+        turns[0].set()
+        outcomes = []
+        
+        async def deliver(parsed, turn):
+            caption = f"📱 Downloaded from Instagram {parsed.content_type}"
+            shortcode = parsed.key if parsed.cacheable else None
+            
+            job = await self.journal.job(update_id, parsed.key or parsed.url)
+            if job.state == 'sent':
+                return True
+            
+            cached = self.media_cache.get(shortcode) if shortcode else None
+            if cached:
+                await turn.wait()
+                if await self.send_cached_media(chat_id, cached, caption):
+                    await job.mark('sent')
+                    return True
+                self.media_cache.invalidate(shortcode)
+            
+            resumed = self.resume_job(job)
+            if resumed:
+                try:
+                    await turn.wait()
+                    sent = await self.upload_files(chat_id, resumed, shortcode, caption) > 0
+                finally:
+                    self.cleanup_download((resumed, None))
+                if sent:
+                    await job.mark('sent')
+                return sent
+            
+            if self.config.DIRECT_URL_DELIVERY or self.config.STREAM_RELAY:
+                async for media in self.remote_media(parsed, shortcode, job):
+                    await turn.wait()
+                    if await self.deliver_resolved(chat_id, media, shortcode, caption):
+                        await job.mark('sent')
+                        return True
+            
+            async with self.coalescer.share((parsed.kind, parsed.key), lambda: self.download_instagram_content(parsed)) as result:
+                files, error = result
+                if files and not error:
+                    await job.mark('downloaded', [str(file_path) for file_path in files])
+                await turn.wait()
+                if not files or error:
+                    logger.warning(f"Batch item {parsed.url} failed: {error}")
+                    return False
+                sent = await self.upload_files(chat_id, files, shortcode, caption) > 0
+            if sent:
+                await job.mark('sent')
+            return sent
+        
+        async def run(index, parsed):
+            try:
+                ok = await deliver(parsed, turns[index])
+            except Exception as e:
+                logger.error(f"Batch item {parsed.url} failed: {e}")
+                ok = False
+            finally:
+                # Keep message order even when this link failed early
+                await turns[index].wait()
+            outcomes.append(ok)
+            progress.update(self.batch_status(len(urls), outcomes))
+            if index + 1 < len(turns):
+                turns[index + 1].set()
+        
+        await asyncio.gather(*(run(i, parsed) for i, parsed in enumerate(urls)))
+        await progress.finish(self.batch_status(len(urls), outcomes))
+    
+    def batch_status(self, total, outcomes):
+        """Progress line for a batch: how many links are done, sent and failed"""
+        sent = sum(outcomes)
+        failed = len(outcomes) - sent
+        status = "✅ Done" if len(outcomes) == total else "⏳ Working..."
+        return (
+            f"{status} {len(outcomes)}/{total} processed\n"
+            f"🎉 {sent} sent, ❌ {failed} failed"
+        )
+    
+    def cleanup_download(self, result):
+        """Release the scratch directory of a download once nobody needs its files any more"""
+        files, _ = result
+        for job_dir in {file_path.parent for file_path in files or []}:
+            upload = self.archiving.get(job_dir)
+            if upload is not None:
+                # Keep the files until their copy to shared storage has finished
+                upload.add_done_callback(lambda _, job_dir=job_dir: self.scratch.release(job_dir))
+            else:
+                self.scratch.release(job_dir)
+    
+    async def send_cached_media(self, chat_id, media, caption=""):
+        """Re-send media already on Telegram's servers by file_id"""
+        try:
+            album = [item for item in media if item.media_type in ('photo', 'video')]
+            if len(album) > 1:
+                await self.send_media_group(
+                    chat_id, [(item.media_type, item.file_id) for item in album], caption
+                )
+                media = [item for item in media if item not in album]
+                caption = ""
+            
+            for item in media:
+                if item.media_type == 'photo':
+                    await self.sender.send_photo(chat_id=chat_id, photo=item.file_id, caption=caption)
+                elif item.media_type == 'video':
+                    await self.sender.send_video(chat_id=chat_id, video=item.file_id, caption=caption,
+                                              supports_streaming=True)
+                elif item.media_type == 'audio':
+                    await self.sender.send_audio(chat_id=chat_id, audio=item.file_id, caption=caption)
+                else:
+                    await self.sender.send_document(chat_id=chat_id, document=item.file_id, caption=caption)
+            logger.info("Sent cached file(s) by file_id")
+            return True
+        except Exception as e:
+            logger.warning(f"Cached file_id send failed, downloading again: {e}")
+            return False
+    
     async def process_update(self, update):
         """Process a single update"""
         if not update.message or not update.message.text:
@@ -436,10 +1036,12 @@ class RobustInstagramBot:
             
         text = update.message.text
         chat_id = update.message.chat_id
+        with self.metrics.stage('url_parse'):
+            parsed_urls = find_urls(text)[:self.config.MAX_BATCH_URLS]
         
         # Handle commands
         if text == '/start':
-            await self.bot.send_message(
+            await self.sender.send_message(
                 chat_id=chat_id,
                 text="🤖 **Robust Instagram Downloader Bot**\n\n"
                      "Welcome! I can download content from Instagram posts.\n\n"
@@ -456,7 +1058,7 @@ class RobustInstagramBot:
                      "Send me an Instagram post URL and I'll download the content for you!"
             )
         elif text == '/help':
-            await self.bot.send_message(
+            await self.sender.send_message(
                 chat_id=chat_id,
                 text="📖 **Help Information**\n\n"
                      "This bot downloads content from Instagram posts.\n\n"
@@ -481,74 +1083,39 @@ class RobustInstagramBot:
                      "4. Wait for the content to be downloaded and sent"
             )
         elif text == '/status':
-            ytdlp_status = "✅" if self.check_ytdlp() else "❌"
-            await self.bot.send_message(
+            ytdlp_status = "✅" if await self.check_ytdlp() else "❌"
+            cache_stats = self.media_cache.stats()
+            send_stats = self.send_scheduler.stats()
+            scratch_stats = self.scratch.stats()
+            proxy_stats = self.proxy_pool.stats()
+            proxy_line = (
+                f"🌐 Proxies: {proxy_stats['healthy']} of {proxy_stats['total']} in rotation\n"
+                if proxy_stats['total'] else ""
+            )
+            await self.sender.send_message(
                 chat_id=chat_id,
                 text="📊 **Bot Status**\n\n"
                      "✅ Bot is running\n"
                      "✅ Robust Instagram downloader enabled\n"
                      f"{ytdlp_status} yt-dlp {'installed' if ytdlp_status == '✅' else 'not installed'}\n"
-                     "❌ AWS S3 not configured (using local storage)\n"
+                     f"📦 Media cache: {cache_stats['entries']} posts, "
+                     f"{cache_stats['hits']} hits / {cache_stats['misses']} misses\n"
+                     f"📤 Send queue: {send_stats['queued']} waiting, "
+                     f"{send_stats['retried']} flood-limit retries\n"
+                     f"💾 Scratch: {scratch_stats['used'] // (1024 * 1024)}MB used of "
+                     f"{scratch_stats['quota'] // (1024 * 1024)}MB, {scratch_stats['jobs']} jobs\n"
+                     f"{proxy_line}"
+                     f"{'✅' if self.storage.enabled else '❌'} {self.storage.description}\n"
                      "✅ Direct photo extraction\n"
                      "✅ Multiple content types supported\n\n"
                      "Ready to download Instagram content!"
             )
-        elif self.is_instagram_url(text):
-            content_type = self.detect_content_type(text)
-            await self.bot.send_message(
-                chat_id=chat_id,
-                text=f"🔗 **Instagram {content_type.title()} Detected**\n\n"
-                     f"Processing your Instagram {content_type}...\n"
-                     "⏳ This may take a few moments."
-            )
-            
-            # Download content
-            files, error = await self.download_instagram_content(text)
-            
-            if files and not error:
-                await self.bot.send_message(
-                    chat_id=chat_id,
-                    text=f"✅ **Download Successful!**\n\n"
-                         f"Found {len(files)} file(s).\n"
-                         "Sending content to you..."
-                )
-                
-                success_count = 0
-                for file_path in files:
-                    success = await self.send_media(
-                        chat_id=chat_id,
-                        file_path=file_path,
-                        caption=f"📱 Downloaded from Instagram {content_type}"
-                    )
-                    if success:
-                        success_count += 1
-                
-                if success_count > 0:
-                    await self.bot.send_message(
-                        chat_id=chat_id,
-                        text=f"🎉 **Content sent successfully!**\n\n"
-                             f"Sent {success_count} out of {len(files)} files.\n"
-                             "Enjoy your content! 🎬"
-                    )
-                else:
-                    await self.bot.send_message(
-                        chat_id=chat_id,
-                        text="❌ **Failed to send any files**\n\n"
-                             "All files were too large or had errors."
-                    )
-            else:
-                await self.bot.send_message(
-                    chat_id=chat_id,
-                    text=f"❌ **Download Failed**\n\n"
-                         f"Error: {error}\n\n"
-                         "Please check:\n"
-                         "• The URL is correct\n"
-                         "• The post is public\n"
-                         "• The post contains media\n"
-                         "• Try a different post"
-                )
+        elif len(parsed_urls) > 1:
+            await self.handle_batch(chat_id, parsed_urls, update.update_id)
+        elif parsed_urls:
+            await self.handle_instagram_url(chat_id, parsed_urls[0], update.update_id)
         else:
-            await self.bot.send_message(
+            await self.sender.send_message(
                 chat_id=chat_id,
                 text="💬 **Message Received**\n\n"
                      "I can help you download Instagram content!\n\n"
@@ -559,17 +1126,12 @@ class RobustInstagramBot:
                      "• /help for instructions\n"
                      "• /status to check bot status"
             )
-        
-        # Update the last processed update ID
-        self.last_update_id = update.update_id
     
-    def check_ytdlp(self):
+    async def check_ytdlp(self):
         """Check if yt-dlp is installed"""
-        try:
-            result = subprocess.run(['yt-dlp', '--version'], capture_output=True, text=True)
-            return result.returncode == 0
-        except:
-            return False
+        if self.ytdlp_engine.available:
+            return True
+        return await self.ytdlp.available()
     
     async def run(self):
         """Main bot loop"""
@@ -579,22 +1141,35 @@ class RobustInstagramBot:
         print("⏹️  Press Ctrl+C to stop the bot")
         
         # Check dependencies
-        if not self.check_ytdlp():
+        if not await self.check_ytdlp():
             print("⚠️  Warning: yt-dlp is not installed. Please install it for content downloading.")
             print("   Install with: pip install yt-dlp")
+        elif self.ytdlp_engine.available:
+            self.ytdlp_engine.start()
+        self.scratch.start()
+        self.proxy_pool.start()
+        self.storage.start()
+        if self.config.METRICS_PORT:
+            self.metrics_server = await self.metrics.serve(self.config.METRICS_PORT)
+            print(f"📈 Metrics at http://localhost:{self.config.METRICS_PORT}/metrics")
+        self.resume_journal()
         
-        while True:
-            try:
-                updates = await self.get_updates()
-                for update in updates:
-                    await self.process_update(update)
-                await asyncio.sleep(1)  # Wait 1 second before checking for new updates
-            except KeyboardInterrupt:
-                print("\n🛑 Stopping bot...")
-                break
-            except Exception as e:
-                logger.error(f"Error in main loop: {e}")
-                await asyncio.sleep(5)  # Wait 5 seconds before retrying
+        try:
+            while True:
+                try:
+                    updates = await self.get_updates()
+                    await self.accept_updates(updates)
+                    await asyncio.sleep(1)  # Wait 1 second before checking for new updates
+                except Exception as e:
+                    logger.error(f"Error in main loop: {e}")
+                    await asyncio.sleep(5)  # Wait 5 seconds before retrying
+        finally:
+            # Ctrl+C reaches us as a cancellation under asyncio.run, not as KeyboardInterrupt
+            print("\n🛑 Stopping bot...")
+            await self.dispatcher.drain()
+            await self.journal.close()
+            await self.http.aclose()
+            self.ytdlp_engine.shutdown()
 
 async def main():
     """Main function"""
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import mimetypes
+from datetime import datetime, timedelta, timezone
+
+from media_descriptor import MediaDescriptor
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # Storage stays local
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+LIFECYCLE_RULE_ID = 'instagram-bot-media-expiry'
+
+
+class MediaStorage:
+    """Local storage: downloads live only in the scratch space and are gone after delivery"""
+
+    enabled = False
+    description = "AWS S3 not configured (using local storage)"
+
+    async def fetch(self, key):
+        """Media previously stored under key, as deliverable descriptors, or None"""
+        return None
+
+    async def store(self, key, items):
+        """Keep (file_path, media_type) items under key; returns whether they were stored"""
+        return False
+
+    def start(self):
+        """Start any background setup in the running event loop"""
+
+
+class S3Storage(MediaStorage):
+    """Persistent, shared media store on S3 (or any S3-compatible endpoint)
+
+    Finished downloads are uploaded with multipart transfers, so every bot
+    replica can serve them afterwards without downloading from Instagram
+    again. Telegram gets presigned URLs; objects expire through a bucket
+    lifecycle rule on the media prefix. A manifest written after the media
+    marks a post as complete, so a half-uploaded post is never served.
+    """
+
+    enabled = True
+
+    def __init__(self, config):
+        self.config = config
+        self.bucket = config.S3_BUCKET_NAME
+        self.prefix = config.S3_PREFIX
+        self.description = f"AWS S3 bucket {self.bucket} (shared media cache)"
+        self.client = boto3.client(
+            's3',
+            region_name=config.AWS_REGION,
+            aws_access_key_id=config.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=config.AWS_SECRET_ACCESS_KEY,
+            endpoint_url=config.S3_ENDPOINT_URL,
+            config=BotoConfig(max_pool_connections=config.S3_MAX_CONCURRENCY * 2)
+        )
+        self.transfer = TransferConfig(
+            multipart_threshold=config.S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=config.S3_MULTIPART_CHUNK,
+            max_concurrency=config.S3_MAX_CONCURRENCY
+        )
+        self.setup = None
+
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+
+    def _manifest_key(self, key):
+        return f"{self.prefix}{key}/manifest.json"
+
+    async def fetch(self, key):
+        try:
+            response = await asyncio.to_thread(
+                self.client.get_object, Bucket=self.bucket, Key=self._manifest_key(key)
+            )
+            manifest = json.loads(await asyncio.to_thread(response['Body'].read))
+
+            # Don't hand out objects the lifecycle rule is about to delete
+            age = datetime.now(timezone.utc) - response['LastModified']
+            if age > timedelta(days=self.config.S3_EXPIRY_DAYS) - timedelta(seconds=self.config.S3_URL_TTL):
+                self.misses += 1
+                return None
+
+            media = [
+                MediaDescriptor(
+                    self.client.generate_presigned_url(
+                        'get_object',
+                        Params={'Bucket': self.bucket, 'Key': item['key']},
+                        ExpiresIn=self.config.S3_URL_TTL
+                    ),
+                    item['media_type']
+                )
+                for item in manifest['media']
+            ]
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                logger.warning(f"S3 lookup for {key} failed: {e}")
+            self.misses += 1
+            return None
+        except Exception as e:
+            # Unreachable endpoint, missing credentials, a corrupt manifest: fall back to Instagram
+            logger.warning(f"S3 lookup for {key} failed: {e}")
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return media
+
+    async def store(self, key, items):
+        media = []
+        try:
+            for index, (file_path, media_type) in enumerate(items):
+                object_key = f"{self.prefix}{key}/{index:02d}{file_path.suffix.lower()}"
+                content_type = mimetypes.guess_type(file_path.name)[0] or 'application/octet-stream'
+                # upload_file switches to a parallel multipart upload above the threshold
+                await asyncio.to_thread(
+                    self.client.upload_file,
+                    str(file_path), self.bucket, object_key,
+                    ExtraArgs={'ContentType': content_type},
+                    Config=self.transfer
+                )
+                media.append({'key': object_key, 'media_type': media_type})
+
+            await asyncio.to_thread(
+                self.client.put_object,
+                Bucket=self.bucket,
+                Key=self._manifest_key(key),
+                Body=json.dumps({'media': media}).encode(),
+                ContentType='application/json'
+            )
+        except Exception as e:
+            logger.error(f"Storing {key} in S3 failed: {e}")
+            return False
+
+        self.stored += 1
+        logger.info(f"Stored {len(media)} file(s) for {key} in s3://{self.bucket}/{self.prefix}{key}/")
+        return True
+
+    def start(self):
+        if self.config.S3_MANAGE_LIFECYCLE and self.setup is None:
+            self.setup = asyncio.create_task(asyncio.to_thread(self._ensure_lifecycle))
+
+    def _ensure_lifecycle(self):
+        """Add or update the expiry rule for the media prefix, keeping the bucket's other rules"""
+        try:
+            try:
+                rules = self.client.get_bucket_lifecycle_configuration(Bucket=self.bucket)['Rules']
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') != 'NoSuchLifecycleConfiguration':
+                    raise
+                rules = []
+
+            rules = [rule for rule in rules if rule.get('ID') != LIFECYCLE_RULE_ID]
+            rules.append({
+                'ID': LIFECYCLE_RULE_ID,
+                'Filter': {'Prefix': self.prefix},
+                'Status': 'Enabled',
+                'Expiration': {'Days': self.config.S3_EXPIRY_DAYS},
+                'AbortIncompleteMultipartUpload': {'DaysAfterInitiation': 1},
+            })
+            self.client.put_bucket_lifecycle_configuration(
+                Bucket=self.bucket, LifecycleConfiguration={'Rules': rules}
+            )
+            logger.info(f"S3 lifecycle: {self.prefix}* expires after {self.config.S3_EXPIRY_DAYS} days")
+        except Exception as e:
+            logger.warning(f"Could not set the S3 lifecycle rule, objects won't expire automatically: {e}")
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'stored': self.stored}
+
+
+def storage_from_config(config):
+    """S3 storage when a bucket is configured and boto3 is installed, local storage otherwise"""
+    if not config.S3_BUCKET_NAME:
+        return MediaStorage()
+    if boto3 is None:
+        logger.warning("S3_BUCKET_NAME is set but boto3 is not installed; using local storage")
+        return MediaStorage()
+    return S3Storage(config)
@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import os
+import shutil
+import socket
+import time
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_PROCESS_PREFIX = 'proc-'
+
+
+class ScratchFull(Exception):
+    """No scratch space became free before the admission timeout"""
+
+
+def _abandoned(entry, max_age):
+    """Whether a scratch entry under the shared root belongs to no running process"""
+    host, _, pid = entry.name[len(_PROCESS_PREFIX):].rpartition('-')
+    if entry.name.startswith(_PROCESS_PREFIX) and host == socket.gethostname() and pid.isdigit():
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except (PermissionError, OverflowError):
+            return False
+        return False
+    # Another host's directory on a shared volume, or a pre-upgrade leftover: only age tells
+    try:
+        return time.time() - entry.stat().st_mtime > max_age
+    except OSError:
+        return False
+
+
+def _disk_usage(path):
+    """Bytes used by the files under path"""
+    total = 0
+    for file in path.rglob('*'):
+        try:
+            if file.is_file():
+                total += file.stat().st_size
+        except OSError:
+            pass  # Removed while we were walking
+    return total
+
+
+class _Tier:
+    def __init__(self, base, quota):
+        # Each process works in its own subdirectory of the shared root
+        self.base = Path(base)
+        self.root = self.base / f"{_PROCESS_PREFIX}{socket.gethostname()}-{os.getpid()}"
+        self.quota = quota
+        self.reserved = 0
+
+
+class ScratchSpace:
+    """Per-job temp directories with a disk quota, admission control and eviction
+
+    Every download gets its own directory, reserved against the quota before
+    it starts and removed as a whole when the job releases it, so stray
+    files (.part leftovers, extra yt-dlp outputs, skipped items) go with it.
+    Jobs wait for space rather than filling the disk. Directories that
+    outlive max_age, or leftovers of a previous run, are evicted by a
+    periodic sweep.
+
+    Job directories live in a per-process subdirectory (proc-<host>-<pid>),
+    and the quota is per process. Processes sharing the root (yt-dlp's
+    spawned workers, several bot workers on one host) only ever clean up
+    their own subdirectory and those of processes that are gone.
+
+    An optional memory tier (a tmpfs mount such as /dev/shm) takes small
+    photo jobs while it has room. Directories listed in `keep` survive the
+    startup sweep and are adopted as jobs, for downloads a resumed update
+    still needs.
+    """
+
+    def __init__(self, root, quota, max_age, sweep_interval, admission_timeout,
+                 memory_root=None, memory_quota=0, keep=()):
+        self.disk = _Tier(root, quota)
+        self.memory = _Tier(memory_root, memory_quota) if memory_root else None
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self.admission_timeout = admission_timeout
+
+        self.active = {}  # job dir -> (tier, reserve, created)
+        self.freed = None
+        self.evictor = None
+        self.evicted = 0
+
+        for tier in self.tiers:
+            tier.root.mkdir(parents=True, exist_ok=True)
+        self.sweep(keep)
+
+    @property
+    def tiers(self):
+        return [tier for tier in (self.disk, self.memory) if tier is not None]
+
+    def sweep(self, keep=()):
+        """Remove leftovers of earlier runs but `keep`; only safe before any job starts"""
+        for job_dir in {Path(path) for path in keep}:
+            tier = next((tier for tier in self.tiers if job_dir.parent.parent == tier.base), None)
+            if tier is not None and job_dir.is_dir():
+                size = _disk_usage(job_dir)
+                tier.reserved += size
+                self.active[job_dir] = (tier, size, time.monotonic())
+        for tier in self.tiers:
+            self._remove_leftovers(tier)
+        if self.evicted:
+            logger.info(f"Removed {self.evicted} orphaned scratch entries")
+        if self.active:
+            logger.info(f"Kept {len(self.active)} scratch directories for interrupted jobs")
+
+    async def acquire(self, key, reserve, memory=False):
+        """Create a job directory once `reserve` bytes fit in the quota"""
+        if memory and self.memory and self.memory.reserved + reserve <= self.memory.quota:
+            return self._create(self.memory, key, reserve)
+
+        if self.freed is None:
+            self.freed = asyncio.Condition()
+        tier = self.disk
+        async with self.freed:
+            try:
+                await asyncio.wait_for(
+                    self.freed.wait_for(lambda: tier.reserved + reserve <= tier.quota or not self.active),
+                    timeout=self.admission_timeout
+                )
+            except asyncio.TimeoutError:
+                raise ScratchFull(f"Scratch space full ({tier.reserved // (1024 * 1024)}MB reserved)")
+            return self._create(tier, key, reserve)
+
+    def _create(self, tier, key, reserve):
+        job_dir = tier.root / f"{key}-{uuid.uuid4().hex[:8]}"
+        job_dir.mkdir()
+        tier.reserved += reserve
+        self.active[job_dir] = (tier, reserve, time.monotonic())
+        return job_dir
+
+    def release(self, job_dir):
+        """Delete a job directory and return its reservation"""
+        entry = self.active.pop(job_dir, None)
+        self._remove(job_dir)
+        if entry is None:
+            return
+        tier, reserve, _ = entry
+        tier.reserved -= reserve
+        if self.freed is not None:
+            asyncio.ensure_future(self._notify())
+
+    async def _notify(self):
+        async with self.freed:
+            self.freed.notify_all()
+
+    @staticmethod
+    def _remove(path):
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+
+    def start(self):
+        """Start periodic eviction in the running event loop"""
+        if self.evictor is None or self.evictor.done():
+            self.evictor = asyncio.create_task(self._evict_loop())
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.evict()
+            except Exception as e:
+                logger.error(f"Scratch eviction failed: {e}")
+
+    def evict(self):
+        """Release jobs older than max_age, remove files no job owns, then enforce the quota"""
+        now = time.monotonic()
+        for job_dir, (_, _, created) in list(self.active.items()):
+            if now - created > self.max_age:
+                logger.warning(f"Evicting stale scratch directory {job_dir}")
+                self.release(job_dir)
+                self.evicted += 1
+
+        for tier in self.tiers:
+            self._remove_leftovers(tier)
+
+        # Reservations are estimates; if real usage still overshoots, drop the oldest jobs
+        for tier in self.tiers:
+            used = _disk_usage(tier.root)
+            jobs = sorted(
+                (created, job_dir) for job_dir, (owner, _, created) in self.active.items() if owner is tier
+            )
+            for _, job_dir in jobs:
+                if used <= tier.quota:
+                    break
+                logger.warning(f"Scratch usage {used // (1024 * 1024)}MB over quota, evicting {job_dir}")
+                used -= _disk_usage(job_dir)
+                self.release(job_dir)
+                self.evicted += 1
+
+    def _remove_leftovers(self, tier):
+        """Remove entries no job owns, in our directory and those of dead processes"""
+        owners = [tier.root] + [
+            entry for entry in tier.base.iterdir()
+            if entry != tier.root and _abandoned(entry, self.max_age)
+        ]
+        for owner in owners:
+            if not owner.name.startswith(_PROCESS_PREFIX) or not owner.is_dir():
+                self._remove(owner)  # Laid out before per-process directories
+                self.evicted += 1
+                continue
+            for entry in owner.iterdir():
+                if entry in self.active:
+                    continue
+                self._remove(entry)
+                self.evicted += 1
+            if owner != tier.root and not any(owner.iterdir()):
+                owner.rmdir()
+
+    def stats(self):
+        """Reservations, actual usage and eviction count"""
+        stats = {
+            'jobs': len(self.active),
+            'reserved': self.disk.reserved,
+            'used': _disk_usage(self.disk.root),
+            'quota': self.disk.quota,
+            'evicted': self.evicted,
+        }
+        if self.memory:
+            stats['memory_reserved'] = self.memory.reserved
+            stats['memory_used'] = _disk_usage(self.memory.root)
+        return stats
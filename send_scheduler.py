@@ -0,0 +1,223 @@
+import asyncio
+import itertools
+import logging
+import time
+
+from asyncio_throttle import Throttler
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_MEDIA = 0
+PRIORITY_STATUS = 1
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available"""
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds):
+        """Honor a server-imposed pause (RetryAfter)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    @property
+    def idle(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity and time.monotonic() >= self.blocked_until
+
+
+class _Job:
+    def __init__(self, chat_id, call, future):
+        self.chat_id = chat_id
+        self.call = call
+        self.future = future
+        self.attempts = 0
+
+
+class SendScheduler:
+    """Central outbound queue for Telegram API calls
+
+    Calls are rate limited globally and per chat (groups get their own, slower
+    bucket), media goes ahead of status chatter, calls to one chat run one at a
+    time in order, and RetryAfter responses pause the chat and requeue the call.
+    With a shared job queue every worker process runs its own scheduler, so
+    each one takes an equal share of the bot-wide global rate.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        workers = config.JOB_WORKERS if config.JOB_QUEUE_DB else 1
+        self.global_limit = Throttler(rate_limit=max(1, config.TELEGRAM_GLOBAL_RATE // workers), period=1.0)
+        self.buckets = {}
+        self.busy = set()
+        self.queue = []  # (priority, seq, job); scanned for the best ready entry
+        self.sequence = itertools.count()
+        self.wakeup = None
+        self.worker = None
+
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _bucket(self, chat_id):
+        bucket = self.buckets.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id < 0:
+                # Groups and channels: 20 messages per minute
+                bucket = TokenBucket(self.config.TELEGRAM_GROUP_RATE / 60, self.config.TELEGRAM_GROUP_BURST)
+            else:
+                bucket = TokenBucket(self.config.TELEGRAM_CHAT_RATE, self.config.TELEGRAM_CHAT_BURST)
+            self.buckets[chat_id] = bucket
+        return bucket
+
+    async def submit(self, chat_id, call, priority=PRIORITY_STATUS):
+        """Queue call (a zero-argument coroutine factory) and wait for its result"""
+        if self.worker is None or self.worker.done():
+            self.wakeup = asyncio.Event()
+            self.worker = asyncio.create_task(self._run())
+
+        job = _Job(chat_id, call, asyncio.get_running_loop().create_future())
+        self._enqueue(priority, job)
+        return await job.future
+
+    def _enqueue(self, priority, job, seq=None):
+        self.queue.append((priority, next(self.sequence) if seq is None else seq, job))
+        self.wakeup.set()
+
+    def _next_ready(self):
+        """Pop the highest-priority job whose chat may send now; else return the wait time"""
+        now = time.monotonic()
+        best = None
+        wait = None
+        # Callers that gave up waiting (a superseded progress edit) don't need the call made
+        self.queue = [entry for entry in self.queue if not entry[2].future.cancelled()]
+        for entry in self.queue:
+            job = entry[2]
+            if job.chat_id in self.busy:
+                continue
+            delay = self._bucket(job.chat_id).delay(now)
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            if best is None or entry[:2] < best[:2]:
+                best = entry
+
+        if best is None:
+            return None, wait
+        self.queue.remove(best)
+        self._bucket(best[2].chat_id).consume(now)
+        return best, None
+
+    async def _run(self):
+        while True:
+            entry, wait = self._next_ready()
+            if entry is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            async with self.global_limit:
+                self.busy.add(entry[2].chat_id)
+                asyncio.create_task(self._execute(*entry))
+
+    async def _execute(self, priority, seq, job):
+        try:
+            job.attempts += 1
+            result = await job.call()
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+            self._bucket(job.chat_id).block(retry_after)
+            if job.attempts <= self.config.TELEGRAM_MAX_RETRIES:
+                logger.warning(f"Flood limit for chat {job.chat_id}, retrying in {retry_after}s")
+                self.retried += 1
+                # Keep the original sequence number so it stays ahead of newer calls
+                self._enqueue(priority, job, seq)
+            else:
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+        except Exception as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self.busy.discard(job.chat_id)
+            self.wakeup.set()
+            if len(self.buckets) > self.config.TELEGRAM_BUCKET_LIMIT:
+                self._prune()
+
+    def _prune(self):
+        """Forget buckets of idle chats so the table doesn't grow forever"""
+        for chat_id in [c for c, b in self.buckets.items() if b.idle and c not in self.busy]:
+            del self.buckets[chat_id]
+
+    def stats(self):
+        """Queue depth and delivery counters"""
+        return {
+            'queued': len(self.queue),
+            'queued_media': sum(1 for entry in self.queue if entry[0] == PRIORITY_MEDIA),
+            'queued_status': sum(1 for entry in self.queue if entry[0] == PRIORITY_STATUS),
+            'in_flight': len(self.busy),
+            'sent': self.sent,
+            'retried': self.retried,
+            'failed': self.failed,
+        }
+
+
+class ScheduledBot:
+    """Wraps a telegram.Bot so send_*/edit_* calls go through a SendScheduler"""
+
+    MEDIA_METHODS = {'send_photo', 'send_video', 'send_audio', 'send_document', 'send_media_group'}
+
+    def __init__(self, bot, scheduler):
+        self.bot = bot
+        self.scheduler = scheduler
+
+    def __getattr__(self, name):
+        method = getattr(self.bot, name)
+        if not name.startswith(('send_', 'edit_')):
+            return method
+
+        priority = PRIORITY_MEDIA if name in self.MEDIA_METHODS else PRIORITY_STATUS
+
+        async def scheduled(*args, **kwargs):
+            def call():
+                # A retried upload must re-read open files from the start
+                for value in kwargs.values():
+                    if hasattr(value, 'seek'):
+                        value.seek(0)
+                return method(*args, **kwargs)
+            return await self.scheduler.submit(kwargs.get('chat_id'), call, priority)
+
+        return scheduled
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import logging
+import uuid
+from collections import namedtuple
+from contextlib import AsyncExitStack
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# One file in a relayed upload: the multipart field it fills and where to fetch it
+RelayFile = namedtuple('RelayFile', ['field', 'url', 'filename'])
+
+_DONE = object()
+
+
+class RelayTooLarge(Exception):
+    """The source is bigger than the upload limit"""
+
+
+class _Source:
+    """A download stream feeding a bounded chunk queue
+
+    The queue holds at most buffer_chunks chunks: when the upload falls
+    behind, the pump stops reading and TCP flow control slows the CDN down.
+    """
+
+    def __init__(self, response, buffer_chunks, chunk_size, max_size, on_progress):
+        self.response = response
+        self.queue = asyncio.Queue(buffer_chunks)
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.on_progress = on_progress
+        self.content_type = response.headers.get('content-type', 'application/octet-stream')
+        # Content-Length counts encoded bytes, which aiter_bytes doesn't yield
+        self.size = 0 if response.headers.get('content-encoding') else int(response.headers.get('content-length') or 0)
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._pump())
+
+    async def _pump(self):
+        received = 0
+        try:
+            async for chunk in self.response.aiter_bytes(self.chunk_size):
+                received += len(chunk)
+                if received > self.max_size:
+                    raise RelayTooLarge(f"exceeded {self.max_size // (1024 * 1024)}MB while relaying")
+                await self.queue.put(chunk)
+                if self.on_progress:
+                    self.on_progress(received, self.size)
+            await self.queue.put(_DONE)
+        except Exception as e:
+            await self.queue.put(e)
+
+    async def chunks(self):
+        while True:
+            item = await self.queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+class StreamRelay:
+    """Uploads media to Telegram straight from its download stream
+
+    The multipart request body is generated on the fly from the CDN
+    responses, so no temp file is written and the upload starts with the
+    first downloaded chunk.
+    """
+
+    def __init__(self, http, token, config):
+        self.http = http
+        self.api_url = f"https://api.telegram.org/bot{token}"
+        self.config = config
+
+    async def send(self, method, params, files, on_progress=None):
+        """Call a Bot API upload method with files relayed from their URLs; returns the decoded result
+
+        on_progress, if given, is called as on_progress(index, received, total)
+        for each file. The whole call is bounded by RELAY_TIMEOUT.
+        """
+        async with asyncio.timeout(self.config.RELAY_TIMEOUT):
+            return await self._send(method, params, files, on_progress)
+
+    async def _send(self, method, params, files, on_progress):
+        boundary = uuid.uuid4().hex
+        async with AsyncExitStack() as stack:
+            sources = []
+            for index, relay_file in enumerate(files):
+                # Every source stays open until the POST ends, so they can't take per-host
+                # slots one at a time: two carousels could each hold some and wait forever
+                response = await stack.enter_async_context(
+                    self.http.stream('GET', relay_file.url, host_limit=False)
+                )
+                response.raise_for_status()
+                source = _Source(
+                    response,
+                    self.config.RELAY_BUFFER_CHUNKS,
+                    self.config.DOWNLOAD_CHUNK_SIZE,
+                    self.config.MAX_FILE_SIZE,
+                    (lambda received, total, index=index: on_progress(index, received, total)) if on_progress else None
+                )
+                if source.size > self.config.MAX_FILE_SIZE:
+                    raise RelayTooLarge(f"{relay_file.url} is {source.size // (1024 * 1024)}MB")
+                sources.append(source)
+
+            parts = [self._field(boundary, name, value) for name, value in params.items() if value is not None]
+            heads = [self._file_head(boundary, relay_file, source) for relay_file, source in zip(files, sources)]
+            tail = f"--{boundary}--\r\n".encode()
+
+            headers = {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+            if all(source.size for source in sources):
+                length = sum(map(len, parts)) + sum(map(len, heads)) + len(tail)
+                length += sum(source.size + 2 for source in sources)
+                headers['Content-Length'] = str(length)
+
+            async def body():
+                for part in parts:
+                    yield part
+                for head, source in zip(heads, sources):
+                    yield head
+                    async for chunk in source.chunks():
+                        yield chunk
+                    yield b"\r\n"
+                yield tail
+
+            for source in sources:
+                source.start()
+            try:
+                async with self.http.stream('POST', f"{self.api_url}/{method}", content=body(), headers=headers) as response:
+                    payload = json.loads(await response.aread())
+            finally:
+                for source in sources:
+                    source.task.cancel()
+
+        if not payload.get('ok'):
+            description = payload.get('description', 'Unknown error')
+            retry_after = (payload.get('parameters') or {}).get('retry_after')
+            if retry_after:
+                raise RetryAfter(retry_after)
+            if payload.get('error_code') == 400:
+                raise BadRequest(description)
+            raise TelegramError(description)
+        return payload['result']
+
+    @staticmethod
+    def _field(boundary, name, value):
+        if not isinstance(value, str):
+            value = json.dumps(value)
+        return (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+            f"{value}\r\n"
+        ).encode()
+
+    @staticmethod
+    def _file_head(boundary, relay_file, source):
+        return (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{relay_file.field}"; filename="{relay_file.filename}"\r\n'
+            f"Content-Type: {source.content_type}\r\n\r\n"
+        ).encode()
@@ -0,0 +1,72 @@
+import re
+from collections import namedtuple
+
+# One pattern classifies every supported URL shape; the named group that
+# matched tells us what kind of link it is
+_URL_RE = re.compile(r'''
+    https?://(?:(?:www|m)\.)?(?:instagram\.com|instagr\.am)/
+    (?:
+        (?:[A-Za-z0-9_.]+/)?(?P<kind>p|reels?|tv)/(?P<shortcode>[A-Za-z0-9_-]+)
+      | stories/(?P<story_user>[A-Za-z0-9_.]+)/(?P<story_id>\d+)
+      | (?P<username>[A-Za-z0-9_.]+)
+    )
+    (?:[/?#][^\s,]*)?
+''', re.X)
+
+_CONTENT_TYPES = {
+    'post': 'post',  # Could be photo or video
+    'reel': 'video',
+    'tv': 'video',
+    'story': 'story',
+    'profile': 'unknown',
+}
+
+
+class ParsedURL(namedtuple('ParsedURL', ['url', 'kind', 'shortcode', 'username', 'story_id'])):
+    """An Instagram link classified once and passed through the pipeline"""
+    __slots__ = ()
+
+    @property
+    def content_type(self):
+        """Coarse type used in captions and download fallbacks: post, video, story or unknown"""
+        return _CONTENT_TYPES[self.kind]
+
+    @property
+    def key(self):
+        """Stable identifier for caching, coalescing and file names"""
+        return self.shortcode or self.story_id or self.username
+
+    @property
+    def cacheable(self):
+        """Profiles change over time, so only concrete media links are cached"""
+        return self.kind != 'profile'
+
+
+def _parsed(match):
+    kind = match.group('kind')
+    if kind:
+        # /reels/ is an alias of /reel/
+        kind = 'reel' if kind.startswith('reel') else kind
+        kind = 'post' if kind == 'p' else kind
+        return ParsedURL(match.group(0), kind, match.group('shortcode'), None, None)
+    if match.group('story_id'):
+        return ParsedURL(match.group(0), 'story', None, match.group('story_user'), match.group('story_id'))
+    return ParsedURL(match.group(0), 'profile', None, match.group('username'), None)
+
+
+def parse_url(text):
+    """Classify the first Instagram URL in a message, or return None"""
+    match = _URL_RE.search(text)
+    return _parsed(match) if match else None
+
+
+def find_urls(text):
+    """Every distinct Instagram URL in a message, in the order they appear"""
+    seen = set()
+    urls = []
+    for match in _URL_RE.finditer(text):
+        parsed = _parsed(match)
+        if (parsed.kind, parsed.key) not in seen:
+            seen.add((parsed.kind, parsed.key))
+            urls.append(parsed)
+    return urls
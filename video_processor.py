@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import re
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_DURATION_RE = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+
+
+class VideoProcessor:
+    """Shrink oversized videos with ffmpeg so they fit under Telegram's upload limit
+
+    The video bitrate is derived from the duration so the output lands just
+    under target_size, the moov atom is moved to the front (faststart) so
+    Telegram can stream it, and outputs are kept per shortcode in cache_dir.
+    ffmpeg runs as subprocesses behind a bounded pool.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.binary = config.FFMPEG_PATH
+        self.target_size = config.MAX_FILE_SIZE
+        self.cache_dir = Path(config.TRANSCODE_CACHE_DIR)
+        self.cache_dir.mkdir(exist_ok=True)
+        self.slots = asyncio.Semaphore(config.FFMPEG_WORKERS)
+        # Per-output locks, refcounted so one is only dropped once nobody holds or waits on it
+        self.locks = {}
+        self.lock_refs = {}
+        self.in_use = {}  # output -> callers that got it from fit() and haven't released it
+        self._available = None
+
+        self.transcoded = 0
+        self.cache_hits = 0
+
+    async def available(self):
+        """Check once whether the ffmpeg executable can be run"""
+        if self._available is None:
+            try:
+                returncode, _ = await self._run(['-version'], timeout=15)
+                self._available = returncode == 0
+            except Exception:
+                self._available = False
+            if not self._available:
+                logger.warning(f"ffmpeg not found at {self.binary}, oversized videos will be rejected")
+        return self._available
+
+    async def fit(self, file_path, key):
+        """Return a copy of file_path that fits the upload limit, or None if it can't be made to
+
+        A returned output is kept out of cache pruning until release() is called for it.
+        """
+        output = self.cache_dir / f"{key}.mp4"
+        lock = self.locks.setdefault(output, asyncio.Lock())
+        self.lock_refs[output] = self.lock_refs.get(output, 0) + 1
+        try:
+            async with lock:
+                if output.exists() and output.stat().st_size <= self.target_size:
+                    logger.info(f"Using cached compressed video {output}")
+                    output.touch()  # Keeps it at the fresh end of the LRU
+                    self.cache_hits += 1
+                    self._claim(output)
+                    return output
+
+                duration = await self.duration(file_path)
+                if not duration:
+                    logger.warning(f"Could not read the duration of {file_path}, not compressing")
+                    return None
+
+                # Aim a little under the limit: bitrate control is approximate
+                for margin in (0.92, 0.8):
+                    video_bitrate = int(self.target_size * 8 * margin / duration) - self.config.TRANSCODE_AUDIO_BITRATE
+                    if video_bitrate < self.config.TRANSCODE_MIN_VIDEO_BITRATE:
+                        logger.warning(f"{file_path} is too long ({duration:.0f}s) to fit under the limit")
+                        return None
+                    if await self._transcode(file_path, output, video_bitrate):
+                        self.transcoded += 1
+                        self._claim(output)
+                        self._prune()
+                        return output
+                return None
+        finally:
+            self.lock_refs[output] -= 1
+            if self.lock_refs[output] == 0:
+                del self.lock_refs[output]
+                del self.locks[output]
+
+    def _claim(self, output):
+        self.in_use[output] = self.in_use.get(output, 0) + 1
+
+    def release(self, output):
+        """Let an output returned by fit() be pruned again once it has been uploaded"""
+        count = self.in_use.get(output, 0) - 1
+        if count > 0:
+            self.in_use[output] = count
+        else:
+            self.in_use.pop(output, None)
+
+    async def duration(self, file_path):
+        """Media duration in seconds, parsed from ffmpeg's input summary"""
+        _, stderr = await self._run(['-hide_banner', '-i', str(file_path)], timeout=30)
+        match = _DURATION_RE.search(stderr)
+        if not match:
+            return None
+        hours, minutes, seconds = match.groups()
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    async def _transcode(self, source, output, video_bitrate):
+        part = output.with_name(output.name + '.part')
+        logger.info(f"Compressing {source} at {video_bitrate // 1000}kbps")
+        args = [
+            '-hide_banner', '-y', '-i', str(source),
+            '-c:v', 'libx264', '-preset', 'veryfast',
+            '-b:v', str(video_bitrate), '-maxrate', str(video_bitrate), '-bufsize', str(video_bitrate * 2),
+            '-vf', f"scale=-2:'min({self.config.TRANSCODE_MAX_HEIGHT},ih)'",
+            '-c:a', 'aac', '-b:a', str(self.config.TRANSCODE_AUDIO_BITRATE),
+            '-movflags', '+faststart',
+            '-f', 'mp4', str(part)
+        ]
+        try:
+            returncode, stderr = await self._run(args, timeout=self.config.FFMPEG_TIMEOUT)
+            if returncode != 0:
+                logger.error(f"ffmpeg failed: {stderr[-500:]}")
+                return False
+            if part.stat().st_size > self.target_size:
+                logger.warning(f"Compressed output still {part.stat().st_size // (1024 * 1024)}MB")
+                return False
+            part.replace(output)
+            return True
+        finally:
+            part.unlink(missing_ok=True)
+
+    async def _run(self, args, timeout):
+        async with self.slots:
+            process = await asyncio.create_subprocess_exec(
+                self.binary, *args,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                _, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                if process.returncode is None:
+                    logger.warning(f"Killing ffmpeg process {process.pid}")
+                    process.kill()
+                    await process.wait()
+                raise
+        return process.returncode, stderr.decode(errors='replace')
+
+    def _prune(self):
+        """Keep only the most recently used TRANSCODE_CACHE_SIZE outputs, and any still being uploaded"""
+        outputs = sorted(self.cache_dir.glob('*.mp4'), key=lambda path: path.stat().st_mtime, reverse=True)
+        for path in outputs[self.config.TRANSCODE_CACHE_SIZE:]:
+            if path not in self.in_use and path not in self.locks:
+                path.unlink(missing_ok=True)
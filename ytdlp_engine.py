@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from ytdlp_runner import YtDlpTimeout
+
+try:
+    import yt_dlp
+except ImportError:  # Fall back to the CLI runner
+    yt_dlp = None
+
+logger = logging.getLogger(__name__)
+
+YDL_OPTIONS = {
+    'format': 'best[ext=mp4]/best[ext=jpg]/best[ext=png]/best',
+    'noplaylist': True,
+    'no_warnings': True,
+    'quiet': True,
+    'noprogress': True,
+}
+
+# Warm YoutubeDL instances per worker process, keyed by proxy (None = direct).
+# yt-dlp builds its network stack from the options at construction time, so
+# each proxy gets its own instance rather than having the option swapped.
+_options = None
+_ydls = {}
+
+
+def _init_worker(options):
+    global _options
+    _options = dict(options)
+    _ydls[None] = yt_dlp.YoutubeDL(dict(_options))
+
+
+def _warm_up():
+    """No-op job that forces the worker to start and import yt-dlp ahead of time"""
+    return None in _ydls
+
+
+def _instance(proxy):
+    ydl = _ydls.get(proxy)
+    if ydl is None:
+        ydl = _ydls[proxy] = yt_dlp.YoutubeDL(dict(_options, proxy=proxy))
+    return ydl
+
+
+def _download(url, output_template, proxy=None):
+    """Download url inside a worker process; returns an error message or None"""
+    ydl = _instance(proxy)
+    # Each worker handles one job at a time, so adjusting params per call is safe
+    ydl.params['outtmpl']['default'] = output_template
+    try:
+        ydl.download([url])
+        return None
+    except Exception as e:
+        return str(e)
+
+
+class YtDlpEngine:
+    """Embedded yt-dlp engine that reuses warm YoutubeDL instances in worker processes"""
+
+    def __init__(self, max_workers, timeout):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._idle = None
+
+    @property
+    def available(self):
+        return yt_dlp is not None
+
+    @property
+    def version(self):
+        return yt_dlp.version.__version__ if yt_dlp else None
+
+    def _spawn(self):
+        # spawn rather than fork: the bot process runs threads (Flask, event loop)
+        worker = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(YDL_OPTIONS,)
+        )
+        worker.submit(_warm_up)
+        return worker
+
+    def _terminate(self, worker):
+        # ProcessPoolExecutor can't cancel a running job, so kill its process
+        for process in list(getattr(worker, '_processes', {}).values()):
+            process.terminate()
+        worker.shutdown(wait=False, cancel_futures=True)
+
+    def start(self):
+        """Start the worker processes so the first request doesn't pay for imports"""
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for _ in range(self.max_workers):
+                self._idle.put_nowait(self._spawn())
+
+    async def download(self, url, output_template, timeout=None, proxy=None):
+        """Download url to output_template, optionally through a proxy; returns an error message or None"""
+        timeout = timeout or self.timeout
+        self.start()
+
+        loop = asyncio.get_running_loop()
+        worker = await self._idle.get()
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(worker, _download, url, output_template, proxy),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"yt-dlp worker timed out after {timeout}s, restarting it")
+            self._terminate(worker)
+            worker = self._spawn()
+            raise YtDlpTimeout(f"yt-dlp timed out after {timeout}s")
+        except asyncio.CancelledError:
+            self._terminate(worker)
+            worker = self._spawn()
+            raise
+        finally:
+            self._idle.put_nowait(worker)
+
+    def shutdown(self):
+        """Stop all worker processes"""
+        if self._idle is None:
+            return
+        while not self._idle.empty():
+            self._idle.get_nowait().shutdown(wait=False, cancel_futures=True)
+        self._idle = None
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+YtDlpResult = namedtuple('YtDlpResult', ['returncode', 'stdout', 'stderr'])
+
+
+class YtDlpTimeout(Exception):
+    """Raised when a yt-dlp run exceeds its time budget and is killed"""
+
+
+class YtDlpRunner:
+    """Run the yt-dlp CLI as asyncio subprocesses behind a bounded worker pool"""
+
+    def __init__(self, max_workers, timeout, binary='yt-dlp'):
+        self.binary = binary
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(max_workers)
+
+    async def run(self, args, timeout=None):
+        """Run yt-dlp with the given arguments and capture its output"""
+        timeout = timeout or self.timeout
+
+        async with self.slots:
+            process = await asyncio.create_subprocess_exec(
+                self.binary, *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+            except asyncio.TimeoutError:
+                await self._kill(process)
+                raise YtDlpTimeout(f"yt-dlp timed out after {timeout}s")
+            except asyncio.CancelledError:
+                # Don't leave an orphaned download running when the request goes away
+                await self._kill(process)
+                raise
+
+        return YtDlpResult(
+            process.returncode,
+            stdout.decode(errors='replace'),
+            stderr.decode(errors='replace')
+        )
+
+    async def _kill(self, process):
+        if process.returncode is None:
+            logger.warning(f"Killing yt-dlp process {process.pid}")
+            process.kill()
+            await process.wait()
+
+    async def available(self):
+        """Check if the yt-dlp executable can be run"""
+        try:
+            result = await self.run(['--version'], timeout=15)
+            return result.returncode == 0
+        except Exception:
+            return False